@@ -1,19 +1,40 @@
-from dotenv import dotenv_values
+import asyncio
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Iterator
 from pydantic import BaseModel
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from jose import jwt
 from passlib.context import CryptContext
-from database import database, User
+from database import User, get_engine, get_session
+from database.routing import read_session, mark_recent_write
 from database.errors import UserDoesNotExistError
 from database.models.types import SessionData
-from sqlmodel import Session
+from sqlalchemy import event, update
+from sqlmodel import Session, select
+from settings import get_settings
+from api.principals import PrincipalCache, UserPrincipal
 
-DOTENV_CONFIGS = dotenv_values("../.env")
-SECRET_KEY = DOTENV_CONFIGS["HASH_SECRET_KEY"]
 ALGORITHM = "HS256"
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
 OAUTH2_SCHEME = OAuth2PasswordBearer(tokenUrl="token")
+INTERNAL_SCHEME = HTTPBearer(auto_error=False)
+
+
+def secret_key() -> str:
+    """The JWT signing key, read from the settings on first use rather than at import"""
+    key = get_settings().hash_secret_key
+    if not key:
+        raise RuntimeError("HASH_SECRET_KEY is not set")
+    return key
+
+@lru_cache()
+def pwd_context() -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 class Token(BaseModel):
@@ -22,87 +43,205 @@ class Token(BaseModel):
 
 
 class TokenData(BaseModel):
+    user_id: int
     username: str
 
     def to_jwt(self):
         """Converts data within to JWT format"""
-        return jwt.encode({"sub": self.username}, SECRET_KEY, ALGORITHM)
+        expires_at = datetime.utcnow() + timedelta(minutes=get_settings().access_token_expire_minutes)
+        return jwt.encode({"sub": self.username, "uid": self.user_id, "exp": expires_at}, secret_key(), ALGORITHM)
 
     @classmethod
     def from_jwt(cls, data: str):
-        payload = jwt.decode(data, SECRET_KEY, ALGORITHM)
-        return cls(username=payload["sub"])
+        """Decodes a token, raising if it is malformed or expired"""
+        payload = jwt.decode(data, secret_key(), ALGORITHM)
+        return cls(user_id=payload["uid"], username=payload["sub"])
 
 
-# class SessionData:
-#     def __init__(self, conn: Session, user: User):
-#         self.conn = conn
-#         self.user = user
+@lru_cache()
+def principal_cache() -> PrincipalCache:
+    settings = get_settings()
+    return PrincipalCache(settings.principal_cache_size, settings.principal_cache_ttl)
 
-def verify_hashed_password(plain_password, hashed_password) -> bool:
-    return PWD_CONTEXT.verify(plain_password, hashed_password)
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target: User):
+    principal_cache().invalidate(target.id)  # type: ignore
 
-def hash_password(password) -> str:
-    return PWD_CONTEXT.hash(password)
+def get_principal(user_id: int, session: Session) -> UserPrincipal:
+    """Resolves a user id to a principal, from the cache when possible"""
+    principal = principal_cache().get(user_id)
+    if principal:
+        return principal
 
-def create_new_user(name: str, username: str, email: str, password: str) -> User:
-    """Creates a new user in the database"""
-    try:
-        with Session(database) as session:
-            user = User(name=name, email=email, username=username, password=hash_password(password))
+    row = session.exec(select(User.id, User.username, User.name).where(User.id == user_id)).first()
+    if not row:
+        raise UserDoesNotExistError(f"User with id: {user_id} does not exist")
+
+    principal = UserPrincipal(id=row.id, username=row.username, name=row.name)
+    principal_cache().put(principal)
+    return principal
+
+class PasswordWorkers:
+    """
+    Runs bcrypt on a dedicated, size limited thread pool.
+
+    At most workers + queue_depth calls are admitted at once, anything beyond that is rejected with a 503
+    instead of piling up behind the hashes already queued. Callers await the result on the event loop,
+    so queued checks do not hold one of the request threadpool's threads.
+    """
+    def __init__(self, workers: int, queue_depth: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password checks, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            return await asyncio.wrap_future(self._executor.submit(fn, *args))
+        finally:
+            self._slots.release()
+
+@lru_cache()
+def password_workers() -> PasswordWorkers:
+    settings = get_settings()
+    return PasswordWorkers(settings.password_workers, settings.password_queue_depth)
+
+async def verify_hashed_password(plain_password, hashed_password) -> bool:
+    return await password_workers().run(pwd_context().verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password, hashed_password) -> tuple[bool, str | None]:
+    """Verifies the password, also returning a new hash when the stored one uses deprecated settings"""
+    return await password_workers().run(pwd_context().verify_and_update, plain_password, hashed_password)
+
+async def hash_password(password) -> str:
+    return await password_workers().run(pwd_context().hash, password)
+
+def _insert_user(name: str, username: str, email: str, hashed_password: str) -> User:
+    with Session(get_engine()) as session:
+        try:
+            user = User(name=name, email=email, username=username, password=hashed_password)
             session.add(user)
             session.commit()
             session.refresh(user)
+        except Exception as e:
+            session.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+    # The first login resolves the user, keep it off a replica that may not have the row yet
+    mark_recent_write(user.id)  # type: ignore
+    return user
+
+async def create_new_user(name: str, username: str, email: str, password: str) -> User:
+    """
+    Creates a new user in the database.
+
+    The password is hashed before a connection is checked out, so queued bcrypt work never holds a pooled connection.
+    """
+    hashed_password = await hash_password(password)
+    return await run_in_threadpool(_insert_user, name, username, email, hashed_password)
+
+def _get_user(username: str) -> User | None:
+    with Session(get_engine()) as session:
+        try:
+            return User.get_by_username(username, session)
+        except UserDoesNotExistError:
+            return None
 
-def authenticate_user(username: str, password: str) -> User:
+def _store_hash(user_id: int, hashed_password: str):
+    with Session(get_engine()) as session:
+        session.execute(update(User).where(User.id == user_id).values(password=hashed_password))  # type: ignore
+        session.commit()
+
+async def authenticate_user(username: str, password: str) -> User:
     """
     Verifies if the user has the correct login credentials
 
+    The user is looked up, and the rehash stored, on short-lived sessions: no connection is held while bcrypt runs.
     Raises a HTTPException if user is invalid
     """
     credentials_exception = HTTPException(status_code=401, detail="Incorrect Username or Password")
-    with Session(database) as session:
-        try:
-            user = User.get_by_username(username, session)
-        except UserDoesNotExistError:
-            raise credentials_exception
+    user = await run_in_threadpool(_get_user, username)
+    if user is None:
+        raise credentials_exception
 
-    if not verify_hashed_password(password, user.password):
+    valid, new_hash = await verify_and_update_password(password, user.password)
+    if not valid:
         raise credentials_exception
 
+    if new_hash:
+        await run_in_threadpool(_store_hash, user.id, new_hash)  # type: ignore
+
     return user
 
-async def session_data(token: str = Depends(OAUTH2_SCHEME)):
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _token_data(token: str) -> TokenData:
+    try:
+        return TokenData.from_jwt(token)
+    except Exception as e:
+        raise _credentials_exception()
+
+def _resolve_principal(user_id: int, conn: Session) -> UserPrincipal:
+    try:
+        return get_principal(user_id, conn)
+    except UserDoesNotExistError:
+        raise _credentials_exception()
+
+def session_data(token: str = Depends(OAUTH2_SCHEME), conn: Session = Depends(get_session)):
     """
     Returns session data that has a connection and a user attached.
 
+    The user is resolved from the token and the principal cache, the ORM user is only loaded if the handler asks for it.
+    Commits on the session mark the user as a recent writer, see database.routing.
+
     Will raise a HTTP Exception if:
 
-    (1) JWT token is invalid
+    (1) JWT token is invalid or expired
     (2) user does not exist
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    principal = _resolve_principal(_token_data(token).user_id, conn)
+    conn.info["user_id"] = principal.id
+    return SessionData(conn=conn, user_id=principal.id)
 
-    try:
-        token_data = TokenData.from_jwt(token)
-    except Exception as e:
-        raise credentials_exception
+def read_session_data(token: str = Depends(OAUTH2_SCHEME)) -> Iterator[SessionData]:
+    """
+    session_data for read-only handlers.
 
-    with Session(database) as session:
-        try:
-            user = User.get_by_username(token_data.username, session)
-        except UserDoesNotExistError:
-            raise credentials_exception
+    Queries go to the read replica, unless none is configured or the user committed a write within replica_sticky_seconds.
+    """
+    token_data = _token_data(token)
+    with read_session(token_data.user_id) as conn:
+        principal = _resolve_principal(token_data.user_id, conn)
+        yield SessionData(conn=conn, user_id=principal.id)
 
-        yield SessionData(conn=session, user=user)
+def authenticate_token(token: str) -> int:
+    """
+    Resolves a bearer token to a user id without holding a pooled connection past the lookup.
 
+    For long lived requests such as subscriptions, which would otherwise keep a connection checked out while they stay open.
+    """
+    token_data = _token_data(token)
+    with Session(get_engine()) as conn:
+        return _resolve_principal(token_data.user_id, conn).id
 
+def internal_access(credentials: HTTPAuthorizationCredentials | None = Depends(INTERNAL_SCHEME)):
+    """
+    Guards operational endpoints (metrics, pool and cache stats) with the internal_token bearer token.
 
+    Responds 404 while no token is configured, so the endpoints are not reachable by default, and 403 on a wrong token.
+    """
+    expected = get_settings().internal_token
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), expected.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid internal token", headers={"WWW-Authenticate": "Bearer"})
@@ -0,0 +1,141 @@
+import csv
+import io
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import select
+from database import Transaction, UserGroupLink
+from database.models.transactions import check_breakdowns
+from database.models.types import SessionData
+from api.model.request import TransactionPost
+from api.model.response import BulkImportResponse, BulkRowResult
+
+# CSV imports carry one breakdown per line, lines sharing a ref make up one transaction
+CSV_TRANSACTION_COLUMNS = [
+    "description", "amount", "transaction_date", "category", "sub_category", "notes",
+    "is_session", "is_session_closed", "is_itemized", "group_id",
+]
+CSV_BREAKDOWN_COLUMNS = ["payer", "payee", "breakdown_amount"]
+
+# (row number, parsed transaction or the reason it could not be parsed)
+ParsedRow = tuple[int, TransactionPost | str]
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, read in chunks and rejected with a 413 as soon as it goes past max_bytes"""
+    too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Import is larger than {max_bytes} bytes")
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise too_large
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(x) for x in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+def parse_ndjson(body: bytes) -> list[ParsedRow]:
+    """One TransactionPost per line, rows are numbered by line"""
+    rows: list[ParsedRow] = []
+    for number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            rows.append((number, TransactionPost.parse_raw(line)))
+        except ValidationError as e:
+            rows.append((number, _describe(e)))
+    return rows
+
+
+def parse_csv(body: bytes) -> list[ParsedRow]:
+    """Breakdown lines grouped by their integer ref column, rows are numbered by ref"""
+    try:
+        text = body.decode()
+    except UnicodeDecodeError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"CSV must be UTF-8 encoded: {e}")
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {"ref", *CSV_TRANSACTION_COLUMNS, *CSV_BREAKDOWN_COLUMNS} - set(reader.fieldnames or [])
+    if missing:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Missing CSV columns: {sorted(missing)}")
+
+    grouped: dict[int, dict] = {}
+    for number, record in enumerate(reader, start=2):
+        try:
+            ref = int(record["ref"])
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Line {number}: ref must be an integer")
+
+        if ref not in grouped:
+            grouped[ref] = {x: record[x] for x in CSV_TRANSACTION_COLUMNS if record[x] != ""}
+            grouped[ref]["breakdowns"] = []
+        grouped[ref]["breakdowns"].append({
+            "payer": record["payer"], "payee": record["payee"], "amount": record["breakdown_amount"], "item_detail": {},
+        })
+
+    rows: list[ParsedRow] = []
+    for ref, data in grouped.items():
+        try:
+            rows.append((ref, TransactionPost.parse_obj(data)))
+        except ValidationError as e:
+            rows.append((ref, _describe(e)))
+    return rows
+
+
+def import_transactions(rows: list[ParsedRow], session: SessionData) -> BulkImportResponse:
+    """
+    Validates every row in one pass and inserts the valid ones together.
+
+    Rows fail individually on bad totals, payers or payees outside the group, or groups the caller is not a member of.
+    Memberships of every group named are read in one query.
+    """
+    results: list[BulkRowResult] = []
+    parsed: list[tuple[int, TransactionPost]] = []
+    for row, data in rows:
+        if isinstance(data, str):
+            results.append(BulkRowResult(row=row, error=data))
+        else:
+            parsed.append((row, data))
+
+    group_ids = {data.group_id for _, data in parsed}
+    members: dict[int, set[int]] = {}
+    if group_ids:
+        for group_id, user_id in session.conn.exec(select(UserGroupLink.group_id, UserGroupLink.user_id).where(UserGroupLink.group_id.in_(group_ids))):  # type: ignore
+            members.setdefault(group_id, set()).add(user_id)
+
+    valid: list[tuple[int, TransactionPost]] = []
+    for row, data in parsed:
+        try:
+            check_breakdowns(data)
+        except ValueError as e:
+            results.append(BulkRowResult(row=row, error=str(e)))
+            continue
+
+        group_members = members.get(data.group_id, set())
+        if session.user_id not in group_members:
+            results.append(BulkRowResult(row=row, error=f"Not a member of group {data.group_id}"))
+            continue
+
+        outsiders = sorted(({x.payer for x in data.breakdowns} | {x.payee for x in data.breakdowns}) - group_members)
+        if outsiders:
+            results.append(BulkRowResult(row=row, error=f"User with id(s): {outsiders} are not members of group {data.group_id}"))
+            continue
+
+        valid.append((row, data))
+
+    if valid:
+        try:
+            ids = Transaction.bulk_create([x[1] for x in valid], session)
+        except DBAPIError as e:
+            session.conn.rollback()
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Import failed, no rows were inserted: {e.orig}")
+        results += [BulkRowResult(row=row, id=transaction_id) for (row, _), transaction_id in zip(valid, ids)]
+
+    results.sort(key=lambda x: x.row)
+    return BulkImportResponse(inserted=len(valid), failed=len(results) - len(valid), results=results)
@@ -1,47 +1,57 @@
-from database import database, Group, User
-from sqlmodel import Session
+from database import Group
+from database.errors import GroupDoesNotExistError
+from sqlmodel import Session, select
+from storage import get_blob_store
+
+def _get_group(session: Session, group_id: int) -> Group:
+    """Group.get_by_id for callers holding a plain Session rather than SessionData"""
+    group = session.exec(select(Group).where(Group.id == group_id)).first()
+    if not group:
+        raise GroupDoesNotExistError(f"Group with id {group_id} does not exist")
+    return group
 
 def create_group(
+    session: Session,
     name: str,
     group_type: str | None = None,
     image: bytes | None = None,
 ):
-    with Session(database) as session:
-        group = Group(name=name)
-        if group_type:
-            group.type = group_type
-        if image:
-            group.image = image
+    group = Group(name=name)
+    if group_type:
+        group.type = group_type
+    if image:
+        group.image_hash = get_blob_store().put(image)
 
-        session.add(group)
-        session.commit()
+    session.add(group)
+    session.commit()
 
 def update_group(
+    session: Session,
     group_id: int,
     name: str | None = None,
     group_type: str | None = None,
     image: bytes | None = None
 ):
-    with Session(database) as session:
-        group = Group.get_by_id(group_id, session)
-        if name:
-            group.name = name
-        if group_type:
-            group.type = group_type
-        if image:
-            group.image = image
-
-        session.commit()
-
-def delete_group(group_id: int):
-    with Session(database) as session:
-        group = Group.get_by_id(group_id, session)
-        session.delete(group)
-        session.commit()
-
-def add_user_to_group(group_id: int, user_id: int):
-    with Session(database) as session:
-        group = Group.get_by_id(group_id, session)
-        user = User.get_by_id(user_id, session)
-        user.groups.append(group)
-        session.commit()
+    group = _get_group(session, group_id)
+    if name:
+        group.name = name
+    if group_type:
+        group.type = group_type
+    if image:
+        group.image_hash = get_blob_store().put(image)
+
+    session.commit()
+
+def delete_group(session: Session, group_id: int):
+    group = _get_group(session, group_id)
+    session.delete(group)
+    session.commit()
+
+def add_user_to_group(session: Session, group_id: int, user_id: int):
+    Group.add_members(group_id, [user_id], session)
+
+def add_users_to_group(session: Session, group_id: int, user_ids: list[int]) -> list[int]:
+    return Group.add_members(group_id, user_ids, session)
+
+def remove_users_from_group(session: Session, group_id: int, user_ids: list[int]) -> list[int]:
+    return Group.remove_members(group_id, user_ids, session)
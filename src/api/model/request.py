@@ -1,8 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from decimal import Decimal
 from typing import Any
 from datetime import date
 from database.models.transactions import TransactionBase
+from database.models.types import Money
 
 
 class GroupPost(BaseModel):
@@ -13,7 +14,8 @@ class GroupPost(BaseModel):
 class Breakdown(BaseModel):
     payer: int
     payee: int
-    amount: Decimal
+    # Journals store whole cents, finer amounts would be rounded away from the transaction total
+    amount: Money
     item_detail: dict[str, Any]
 
 class TransactionPost(TransactionBase):
@@ -27,4 +29,14 @@ class TransactionPatch(BaseModel):
     transaction_date: date | None = None
     payer_id: int | None = None
     group_id: int | None = None
-    breakdown: dict[int, Breakdown] | None = None
\ No newline at end of file
+    breakdown: dict[int, Breakdown] | None = None
+
+class MembersPost(BaseModel):
+    user_ids: list[int] = Field(..., min_items=1, max_items=10_000)
+
+class GroupsPost(BaseModel):
+    group_ids: list[int] = Field(..., min_items=1, max_items=1_000)
+
+class SessionClosePost(BaseModel):
+    # Every open session of the group when left out
+    transaction_ids: list[int] | None = Field(None, min_items=1, max_items=1_000)
@@ -1,5 +1,18 @@
 from pydantic import BaseModel
 from decimal import Decimal
+from datetime import date, datetime
+from typing import Any
+from fastapi.responses import JSONResponse
+import json
+
+# Defined by the models that build them, so the database package never imports from api
+from database.models.users import UserResponse
+from database.models.link_model.journal import PayStructResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 class Overview(BaseModel):
     balance: Decimal
@@ -8,16 +21,52 @@ class Overview(BaseModel):
 class IDResponse(BaseModel):
     id: int
 
-class UserResponse(BaseModel):
-    id: int
-    name: str
-    push_on: bool
-    email_on: bool
+class BulkRowResult(BaseModel):
+    row: int
+    id: int | None = None
+    error: str | None = None
+
+class BulkImportResponse(BaseModel):
+    inserted: int
+    failed: int
+    results: list[BulkRowResult]
+
+
+class BalancePoint(BaseModel):
+    date: date
+    balances: dict[int, Decimal]
+
+class SessionCloseResponse(BaseModel):
+    closed: list[int]
+    settlement: list[PayStructResponse]
+
+class MembershipResponse(BaseModel):
+    """Memberships the request actually changed, ids that already were (or were not) members are left out"""
+    group_ids: list[int]
+    user_ids: list[int]
+
+
+def _encode_default(value: Any) -> Any:
+    """Encodes the types the JSON libraries do not handle, the same way FastAPI's encoder does"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, "__slots__"):
+        return {x: getattr(value, x) for x in value.__slots__}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_json(content: Any) -> bytes:
+    """Encodes with orjson when installed, which handles slotted dataclasses natively"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_encode_default)
+    return json.dumps(content, default=_encode_default, separators=(",", ":")).encode()
 
-class PayStructResponse(BaseModel):
-    debtor_id: int
-    debtee_id: int
-    amount: Decimal
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for large lists of read models.
 
-    def __str__(self) -> str:
-        return f"{self.debtee_id} -> {self.amount} -> {self.debtor_id}"
\ No newline at end of file
+    Returning it from a handler skips FastAPI's per item response_model validation and jsonable_encoder pass.
+    """
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
@@ -0,0 +1,34 @@
+from sqlmodel import select
+from database import Group, Journal, Transaction, UserGroupLink
+from database.models.types import SessionData
+from database.routing import cache_ttl
+from api.model.response import Overview
+from cache import get_cache, overview_key
+
+
+def get_overview(session: SessionData) -> Overview:
+    """
+    Returns the user's balance and open session count.
+
+    Overviews are cached per user and dropped by the change events of the worker that wrote. Every write to them
+    bumps the version of a group the user is in, and joining or leaving changes the groups, so the (group, version)
+    pairs are stored alongside and a worker that missed the event, or a value computed before it, gets recomputed.
+    """
+    version = [list(x) for x in session.conn.exec(
+        select(Group.id, Group.version)
+        .join(UserGroupLink, UserGroupLink.group_id == Group.id)
+        .where(UserGroupLink.user_id == session.user_id)
+        .order_by(Group.id)
+    )]
+
+    def compute():
+        return {"version": version, "balance": Journal.get_user_balance(session), "sessions": Transaction.count_active_sessions(session)}
+
+    key = overview_key(session.user_id)
+    ttl = cache_ttl(session.conn)
+    cached = get_cache().get_or_set(key, compute, ttl)
+    if cached["version"] != version:
+        get_cache().invalidate([key])
+        cached = get_cache().get_or_set(key, compute, ttl)
+
+    return Overview(balance=cached["balance"], sessions=cached["sessions"])
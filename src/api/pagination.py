@@ -0,0 +1,16 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from fastapi import HTTPException, status
+
+
+def encode_cursor(transaction_date: date, transaction_id: int) -> str:
+    """Opaque cursor pointing after the given (transaction_date, id) key"""
+    return urlsafe_b64encode(f"{transaction_date.isoformat()}:{transaction_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[date, int]:
+    try:
+        transaction_date, transaction_id = urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return date.fromisoformat(transaction_date), int(transaction_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
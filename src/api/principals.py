@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import OrderedDict
+from pydantic import BaseModel
+
+
+class UserPrincipal(BaseModel):
+    """The parts of a user that authentication needs, without any of its relationships"""
+    id: int
+    username: str
+    name: str
+
+
+class PrincipalCache:
+    """Thread safe LRU of principals by user id, entries expire ttl seconds after they are stored"""
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, UserPrincipal]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> UserPrincipal | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, principal: UserPrincipal):
+        with self._lock:
+            self._entries[principal.id] = (time.monotonic() + self._ttl, principal)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
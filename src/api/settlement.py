@@ -0,0 +1,35 @@
+from fastapi import HTTPException, status
+from sqlmodel import select
+from database import Group, Transaction, UserGroupLink
+from database.models.link_model.journal import simplify
+from database.models.types import SessionData
+from api.model.response import PayStructResponse
+from cache import get_cache, settlement_key
+
+
+def get_group_settlement(group_id: int, session: SessionData, optimal: bool = False) -> list[PayStructResponse]:
+    """
+    Returns the settlement plan of a group the user is a member of.
+
+    Plans are cached per group and dropped when the group's transactions change. The group version is stored
+    alongside, so a worker that missed the change event still recomputes instead of serving a stale plan.
+    """
+    version = session.conn.exec(
+        select(Group.version)
+        .join(UserGroupLink, UserGroupLink.group_id == Group.id)
+        .where(Group.id == group_id, UserGroupLink.user_id == session.user_id)
+    ).first()
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Group with id {group_id} does not exist")
+
+    def compute():
+        plan = simplify(Transaction.get_group_balance(group_id, session), optimal)
+        return {"version": version, "plan": [x.dict() for x in plan]}
+
+    key = settlement_key(group_id, optimal)
+    cached = get_cache().get_or_set(key, compute)
+    if cached["version"] != version:
+        get_cache().invalidate([key])
+        cached = get_cache().get_or_set(key, compute)
+
+    return [PayStructResponse(**x) for x in cached["plan"]]
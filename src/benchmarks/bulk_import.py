@@ -0,0 +1,63 @@
+"""
+Measures bulk import throughput against a running server.
+
+Run from the ``src`` directory with a token for a member of the group:
+
+    python -m benchmarks.bulk_import --token <jwt> --group-id 1 --users 1,2,3 --rows 10000
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+import httpx
+
+
+def generate(rows: int, group_id: int, users: list[int], rng: random.Random) -> bytes:
+    """NDJSON of transactions whose breakdowns split the amount between distinct payees"""
+    lines = []
+    start = date(2020, 1, 1)
+    for index in range(rows):
+        payer = rng.choice(users)
+        payees = rng.sample(users, rng.randint(1, len(users)))
+        shares = [rng.randint(1, 10_000) for _ in payees]
+        lines.append(json.dumps({
+            "description": f"Imported {index}",
+            "amount": f"{sum(shares) / 100:.2f}",
+            "transaction_date": (start + timedelta(days=index % 1000)).isoformat(),
+            "group_id": group_id,
+            "breakdowns": [
+                {"payer": payer, "payee": payee, "amount": f"{share / 100:.2f}", "item_detail": {}}
+                for payee, share in zip(payees, shares)
+            ],
+        }))
+    return "\n".join(lines).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bulk_import")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--group-id", type=int, required=True)
+    parser.add_argument("--users", required=True, help="Comma separated ids of group members")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    body = generate(args.rows, args.group_id, [int(x) for x in args.users.split(",")], random.Random(args.seed))
+    start = time.perf_counter()
+    response = httpx.post(
+        f"{args.url}/transaction/bulk",
+        content=body,
+        headers={"Authorization": f"Bearer {args.token}", "Content-Type": "application/x-ndjson"},
+        timeout=600,
+    )
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+
+    result = response.json()
+    print(f"{result['inserted']} inserted, {result['failed']} failed in {elapsed:.2f}s ({args.rows / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
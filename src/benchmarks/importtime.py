@@ -0,0 +1,66 @@
+"""
+Checks that importing the app stays within an import time budget and has no side effects.
+
+Imports ``main`` in a fresh interpreter under ``python -X importtime``, prints the slowest modules and fails when
+the total is over budget, or when the import created the engine or built the password context. Take the best of a
+few runs, the first one also pays for compiling bytecode.
+
+Run from the ``src`` directory: ``python -m benchmarks.importtime --budget-ms 1500``
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent
+
+# Printed by the child after importing main, so import time side effects can be checked from here
+PROBE = (
+    "import main, database, api.authentication as auth; "
+    "print(database._engine is None, auth.pwd_context.cache_info().currsize == 0)"
+)
+
+
+def measure() -> tuple[dict[str, int], list[bool]]:
+    """Cumulative import time in microseconds per module, and the side effect probe results"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=SRC, capture_output=True, text=True, check=True)
+    cumulative: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, micros, module = line[len("import time:"):].split("|")
+        cumulative[module.strip()] = int(micros)
+    return cumulative, [x == "True" for x in result.stdout.split()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime")
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    cumulative, (lazy_engine, lazy_crypto) = min(runs, key=lambda x: x[0].get("main", 0))
+    total_ms = cumulative.get("main", 0) / 1000
+
+    for module, micros in sorted(cumulative.items(), key=lambda x: -x[1])[:args.top]:
+        print(f"{micros / 1000:>9.1f} ms  {module}")
+
+    failed = False
+    if not lazy_engine:
+        print("FAIL importing main created the database engine")
+        failed = True
+    if not lazy_crypto:
+        print("FAIL importing main built the password context")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL import main took {total_ms:.0f} ms, budget is {args.budget_ms:.0f} ms")
+        failed = True
+    else:
+        print(f"ok   import main took {total_ms:.0f} ms, budget is {args.budget_ms:.0f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Measures concurrent request throughput against a running server.
+
+Start the server, log in to get a token, then run from the ``src`` directory:
+
+    python -m benchmarks.load_test --token <jwt> --path /user/overview --concurrency 50 --requests 2000
+
+Login latency under load, where every request runs a bcrypt verification:
+
+    python -m benchmarks.load_test --path /token --form username=<user> --form password=<password>
+
+Run it against two checkouts to compare throughput before and after a change.
+"""
+import argparse
+import asyncio
+import time
+from typing import Awaitable, Callable
+import httpx
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def drive(send: Callable[[], Awaitable[httpx.Response]], concurrency: int, requests: int) -> dict:
+    """Calls send requests times from concurrency workers and summarizes the latencies"""
+    latencies: list[float] = []
+    errors = 0
+    rejected = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors, rejected
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await send()
+                if response.status_code == 503:
+                    rejected += 1
+                elif response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "rejected": rejected,
+        "seconds": elapsed,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run(url: str, path: str, token: str | None, concurrency: int, requests: int, form: dict[str, str] | None = None) -> dict:
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    async with httpx.AsyncClient(base_url=url, headers=headers, timeout=60) as client:
+        def send():
+            return client.get(path) if form is None else client.post(path, data=form)
+
+        return {"path": path, **await drive(send, concurrency, requests)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load_test")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/user/overview")
+    parser.add_argument("--token")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--form", action="append", metavar="KEY=VALUE", help="POST these form fields instead of a GET")
+    args = parser.parse_args()
+    form = dict(x.split("=", 1) for x in args.form) if args.form else None
+
+    result = asyncio.run(run(args.url, args.path, args.token, args.concurrency, args.requests, form))
+    print(f"{result['path']}: {result['throughput']:.1f} req/s over {result['requests']} requests "
+          f"({result['errors']} errors, {result['rejected']} rejected with 503), p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Times onboarding a large group: the per user ORM append that /group/{id}/adduser used to do, against the
+single INSERT ... ON CONFLICT DO NOTHING behind Group.add_members.
+
+Creates its own users and groups, so run it from the ``src`` directory against a local benchmark database:
+
+    python -m benchmarks.membership --members 5000
+"""
+import argparse
+import time
+import uuid
+from sqlalchemy import insert
+from sqlmodel import Session
+from database import get_engine, User, Group
+
+
+def make_users(conn: Session, count: int, prefix: str) -> list[int]:
+    return conn.execute(insert(User.__table__).values([  # type: ignore
+        {"name": f"Member {index}", "username": f"{prefix}_{index}", "email": f"{prefix}_{index}@example.com",
+         "password": "", "push_on": False, "email_on": False}
+        for index in range(count)
+    ]).returning(User.__table__.c.id)).scalars().all()  # type: ignore
+
+
+def make_group(conn: Session, name: str) -> Group:
+    group = Group(name=name)
+    conn.add(group)
+    conn.commit()
+    conn.refresh(group)
+    return group
+
+
+def orm_append(conn: Session, group: Group, user_ids: list[int]):
+    """One request per user, each loading the user and its groups to append to them"""
+    for user_id in user_ids:
+        User.get_by_id(user_id, conn).groups.append(group)
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.membership")
+    parser.add_argument("--members", type=int, default=5_000)
+    args = parser.parse_args()
+    prefix = f"onboard_{uuid.uuid4().hex[:8]}"
+
+    with Session(get_engine()) as conn:
+        user_ids = make_users(conn, args.members, prefix)
+        conn.commit()
+
+        group = make_group(conn, f"{prefix} per user")
+        start = time.perf_counter()
+        orm_append(conn, group, user_ids)
+        per_user = time.perf_counter() - start
+
+        group = make_group(conn, f"{prefix} bulk")
+        start = time.perf_counter()
+        added = Group.add_members(group.id, user_ids, conn)  # type: ignore
+        bulk = time.perf_counter() - start
+
+    print(f"{args.members} members: per user {per_user:.2f}s, bulk {bulk:.3f}s ({len(added)} added), {per_user / bulk:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
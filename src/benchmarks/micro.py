@@ -0,0 +1,77 @@
+"""
+Micro-benchmarks for the pure functions on the write and settlement paths, no database needed.
+
+Run from the ``src`` directory, optionally writing a report to compare with benchmarks.report:
+
+    python -m benchmarks.micro --output micro.json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import date
+from typing import Callable
+from database.models.link_model.balance import journal_deltas
+from database.models.link_model.journal import simplify, OPTIMAL_MAX_MEMBERS
+from database.models.transactions import check_breakdowns, aggregate_breakdowns
+from benchmarks.simplify import random_balance
+from benchmarks.seed import make_transaction
+from benchmarks.report import git_revision
+
+
+def measure(fn: Callable[[], object], repeat: int, number: int) -> dict:
+    """Per call timings in microseconds over repeat rounds of number calls"""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    return {"best_us": min(rounds), "median_us": statistics.median(rounds), "calls": repeat * number}
+
+
+def cases(rng: random.Random) -> dict[str, tuple[Callable[[], object], int]]:
+    """name -> (call, calls per round)"""
+    result: dict[str, tuple[Callable[[], object], int]] = {}
+    for members in (10, 100, 1_000, 10_000):
+        balance = random_balance(members, rng)
+        result[f"simplify/greedy/{members}"] = (lambda balance=balance: simplify(balance), max(1, 10_000 // members))
+
+    balance = random_balance(OPTIMAL_MAX_MEMBERS, rng)
+    result[f"simplify/optimal/{OPTIMAL_MAX_MEMBERS}"] = (lambda: simplify(balance, True), 1)
+
+    members = list(range(1, 51))
+    for fanout in (2, 10, 50):
+        data = make_transaction(1, members, fanout, date.today(), 0, rng, 0)
+        entries = [(x.payer, x.payee, x.amount) for x in data.breakdowns]
+        result[f"check_breakdowns/fanout_{fanout}"] = (lambda data=data: check_breakdowns(data), 1_000)
+        result[f"journal_deltas/fanout_{fanout}"] = (lambda entries=entries: journal_deltas(entries), 1_000)
+
+    # An itemized receipt: every line item names one of a few payer and payee pairs again
+    receipt = [make_transaction(1, members[:4], 4, date.today(), 0, rng, 0).breakdowns for _ in range(100)]
+    items = [x for breakdowns in receipt for x in breakdowns]
+    result[f"aggregate_breakdowns/items_{len(items)}"] = (lambda: aggregate_breakdowns(items), 100)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.micro")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':<28} {'best us':>12} {'median us':>12}")
+    for name, (fn, number) in cases(random.Random(args.seed)).items():
+        results[name] = measure(fn, args.repeat, number)
+        print(f"{name:<28} {results[name]['best_us']:>12.2f} {results[name]['median_us']:>12.2f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"kind": "micro", "revision": git_revision(), "seed": args.seed, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
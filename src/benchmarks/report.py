@@ -0,0 +1,62 @@
+"""
+Compares two benchmark reports written by benchmarks.micro or benchmarks.scenario.
+
+Run from the ``src`` directory: ``python -m benchmarks.report before.json after.json --threshold 10``
+
+Exits with 1 when any case got slower by more than the threshold percentage, so it can gate a change.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# kind -> (metric, True when higher is better)
+METRICS = {
+    "micro": [("median_us", False)],
+    "load": [("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("throughput", True)],
+}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before: dict, after: dict, threshold: float) -> list[str]:
+    """Prints the change of every metric, returning the cases that regressed past threshold percent"""
+    regressions = []
+    for name in sorted(before["results"].keys() & after["results"].keys()):
+        for metric, higher_is_better in METRICS[after["kind"]]:
+            old, new = before["results"][name][metric], after["results"][name][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > threshold else ""
+            print(f"{name:<28} {metric:<12} {old:>12.2f} {new:>12.2f} {change:>+8.1f}% {flag}")
+            if flag:
+                regressions.append(f"{name} {metric}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.report")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="Percentage a metric may worsen before it counts as a regression")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    if before["kind"] != after["kind"]:
+        print(f"Cannot compare a {before['kind']} report with a {after['kind']} report")
+        return 2
+
+    print(f"{before.get('revision')} -> {after.get('revision')}")
+    return 1 if compare(before, after, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Scripted load against the endpoints of a running server.
+
+Seed the database with benchmarks.seed first, then run from the ``src`` directory:
+
+    python -m benchmarks.scenario --manifest seed.json --output load.json
+
+Requests are spread over a pool of logged in seeded users, each asking about one of their own groups. Every read
+endpoint is driven except the /user/subscribe event stream, which holds its connection open, and the internal ones.
+The writes are transaction creation, bulk import, signup, login, and adding then removing group members, both
+through the group and the caller's own membership endpoints. The groups read are given an image first, so the
+image endpoint serves it instead of a 404.
+
+Each endpoint is driven in turn and its throughput and p50/p95/p99 latency go into the JSON report.
+Compare two reports with benchmarks.report.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+from datetime import date, timedelta
+from typing import Callable
+import httpx
+from benchmarks.load_test import drive
+from benchmarks.seed import make_transaction
+from benchmarks.report import git_revision
+
+# name -> path, given a group id and the id of one of its transactions. Names are stable so reports stay comparable when paths change.
+READS: dict[str, Callable[[int, int], str]] = {
+    "user_overview": lambda group_id, transaction_id: "/user/overview",
+    "user_active_sessions": lambda group_id, transaction_id: "/user/active_sessions",
+    "transaction": lambda group_id, transaction_id: f"/transaction?transaction_id={transaction_id}",
+    "group_transactions": lambda group_id, transaction_id: f"/transaction/group_transactions?group_id={group_id}",
+    "group_transactions_stream": lambda group_id, transaction_id: f"/transaction/group_transactions/stream?group_id={group_id}",
+    "group_sessions": lambda group_id, transaction_id: f"/transaction/group_sessions?group_id={group_id}",
+    "simplify_debt": lambda group_id, transaction_id: f"/transaction/simplify_debt?group_id={group_id}",
+    "group_settlement": lambda group_id, transaction_id: f"/group/{group_id}/settlement",
+    "group_users": lambda group_id, transaction_id: f"/group/{group_id}/users",
+    "group_image": lambda group_id, transaction_id: f"/group/{group_id}/image",
+    "group_balance_history": lambda group_id, transaction_id: f"/group/{group_id}/balance_history?since={date.today() - timedelta(days=30)}",
+}
+
+# A 1x1 PNG
+IMAGE = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==")
+
+
+def show(name: str, result: dict):
+    print(f"{name:<26} {result['throughput']:>8.1f} req/s  p50 {result['p50_ms']:>7.1f} ms  "
+          f"p95 {result['p95_ms']:>7.1f} ms  p99 {result['p99_ms']:>7.1f} ms  {result['errors']} errors")
+
+
+async def login(client: httpx.AsyncClient, manifest: dict, count: int, rng: random.Random) -> list[tuple[str, list[int]]]:
+    """(token, group ids) for up to count seeded users that belong to a group"""
+    groups_of: dict[int, list[int]] = {}
+    for group_id, members in manifest["groups"].items():
+        for user_id in members:
+            groups_of.setdefault(user_id, []).append(int(group_id))
+
+    usernames = [username for username, user_id in manifest["users"].items() if user_id in groups_of]
+    sessions = []
+    for username in rng.sample(usernames, min(count, len(usernames))):
+        response = await client.post("/token", data={"username": username, "password": manifest["password"]})
+        response.raise_for_status()
+        sessions.append((response.json()["access_token"], groups_of[manifest["users"][username]]))
+    return sessions
+
+
+async def prepare(client: httpx.AsyncClient, sessions: list[tuple[str, list[int]]]) -> dict[int, list[int]]:
+    """Gives every group the sessions read an image, and returns the ids of a page of each group's transactions"""
+    transaction_ids: dict[int, list[int]] = {}
+    for token, group_ids in sessions:
+        headers = {"Authorization": f"Bearer {token}"}
+        for group_id in group_ids:
+            if group_id in transaction_ids:
+                continue
+            response = await client.put(f"/group/{group_id}/image", files={"image": ("image.png", IMAGE, "image/png")}, headers=headers)
+            response.raise_for_status()
+            response = await client.get(f"/transaction/group_transactions?group_id={group_id}&limit=50", headers=headers)
+            response.raise_for_status()
+            transaction_ids[group_id] = [x["id"] for x in response.json()]
+    return transaction_ids
+
+
+async def run(args: argparse.Namespace, manifest: dict) -> dict:
+    rng = random.Random(args.seed)
+    results = {}
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        sessions = await login(client, manifest, args.logins, rng)
+        transaction_ids = await prepare(client, sessions)
+
+        for name, path in READS.items():
+            def send(path=path):
+                token, group_ids = rng.choice(sessions)
+                group_id = rng.choice(group_ids)
+                transaction_id = rng.choice(transaction_ids[group_id] or [0])
+                return client.get(path(group_id, transaction_id), headers={"Authorization": f"Bearer {token}"})
+
+            results[name] = await drive(send, args.concurrency, args.requests)
+            show(name, results[name])
+
+        def create():
+            token, group_ids = rng.choice(sessions)
+            group_id = rng.choice(group_ids)
+            data = make_transaction(group_id, manifest["groups"][str(group_id)], 4, date.today(), 0, rng, 0)
+            return client.post("/transaction", content=data.json(), headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+
+        results["create_transaction"] = await drive(create, args.concurrency, args.writes)
+        show("create_transaction", results["create_transaction"])
+
+        def bulk():
+            token, group_ids = rng.choice(sessions)
+            group_id = rng.choice(group_ids)
+            members = manifest["groups"][str(group_id)]
+            body = "".join(make_transaction(group_id, members, 4, date.today(), 0, rng, 0).json() + "\n" for _ in range(args.bulk_rows))
+            return client.post("/transaction/bulk", content=body, headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"})
+
+        results["bulk_import"] = await drive(bulk, args.concurrency, args.bulk)
+        show("bulk_import", results["bulk_import"])
+
+        # Seeded users outside a group are added to it, then removed again by the next step
+        user_ids = list(manifest["users"].values())
+        added: list[tuple[str, int, list[int]]] = []
+
+        def add_members():
+            token, group_ids = rng.choice(sessions)
+            group_id = rng.choice(group_ids)
+            members = set(manifest["groups"][str(group_id)])
+            outsiders = rng.sample([x for x in user_ids if x not in members], min(5, len(user_ids) - len(members)))
+            added.append((token, group_id, outsiders))
+            return client.post(f"/group/{group_id}/members", json={"user_ids": outsiders}, headers={"Authorization": f"Bearer {token}"})
+
+        def remove_members():
+            token, group_id, outsiders = added.pop()
+            return client.post(f"/group/{group_id}/members/remove", json={"user_ids": outsiders}, headers={"Authorization": f"Bearer {token}"})
+
+        for name, step in (("add_group_members", add_members), ("remove_group_members", remove_members)):
+            results[name] = await drive(step, args.concurrency, args.memberships)
+            show(name, results[name])
+
+        joined: list[tuple[str, int]] = []
+
+        def join_group():
+            token, group_ids = rng.choice(sessions)
+            group_id = int(rng.choice([x for x in manifest["groups"] if int(x) not in group_ids] or list(manifest["groups"])))
+            joined.append((token, group_id))
+            return client.post("/user/groups", json={"group_ids": [group_id]}, headers={"Authorization": f"Bearer {token}"})
+
+        def leave_group():
+            token, group_id = joined.pop()
+            return client.post("/user/groups/remove", json={"group_ids": [group_id]}, headers={"Authorization": f"Bearer {token}"})
+
+        for name, step in (("join_groups", join_group), ("leave_groups", leave_group)):
+            results[name] = await drive(step, args.concurrency, args.memberships)
+            show(name, results[name])
+
+        # Usernames must be new on every run
+        prefix = uuid.uuid4().hex[:8]
+        signups = iter(range(args.signups))
+
+        def signup():
+            username = f"scenario_{prefix}_{next(signups)}"
+            form = {"name": username, "username": username, "email": f"{username}@example.com", "password": manifest["password"]}
+            return client.post("/signup", data=form)
+
+        results["signup"] = await drive(signup, args.concurrency, args.signups)
+        show("signup", results["signup"])
+
+        def token():
+            username = rng.choice(list(manifest["users"]))
+            return client.post("/token", data={"username": username, "password": manifest["password"]})
+
+        results["login"] = await drive(token, args.concurrency, args.logins)
+        show("login", results["login"])
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.scenario")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--manifest", default="seed.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1_000, help="Requests per read endpoint")
+    parser.add_argument("--writes", type=int, default=500, help="Transactions to create")
+    parser.add_argument("--logins", type=int, default=20, help="Users to log in, and logins to time")
+    parser.add_argument("--bulk", type=int, default=20, help="Bulk imports to run")
+    parser.add_argument("--bulk-rows", type=int, default=100, help="Transactions per bulk import")
+    parser.add_argument("--memberships", type=int, default=200, help="Member additions and removals, and group joins and leaves")
+    parser.add_argument("--signups", type=int, default=50, help="Users to sign up")
+    parser.add_argument("--output", default="load.json")
+    args = parser.parse_args()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+
+    results = asyncio.run(run(args, manifest))
+    report = {
+        "kind": "load",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "scale": manifest["scale"],
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Fills a local database with synthetic users, groups, memberships and transactions for benchmarking.
+
+The data only depends on the seed and the scale arguments, so two checkouts seeded the same way are comparable.
+Every user gets the same password. Ids and memberships are written to a manifest for benchmarks.scenario.
+
+Run from the ``src`` directory against an empty local database:
+
+    python -m benchmarks.seed --users 1000 --groups 100 --members 8 --transactions 100000 --manifest seed.json
+"""
+import argparse
+import json
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from passlib.context import CryptContext
+from sqlalchemy import insert
+from sqlmodel import Session
+from database import get_engine, create_tables, User, Group, UserGroupLink, Transaction
+from database.models.types import SessionData
+from api.model.request import TransactionPost, Breakdown
+
+BATCH = 5_000
+CATEGORIES = ["General", "Food", "Travel", "Utilities", "Entertainment"]
+
+
+def make_transaction(group_id: int, members: list[int], max_fanout: int, day: date, index: int, rng: random.Random, session_ratio: float) -> TransactionPost:
+    """One expense paid by a member and split between up to max_fanout distinct members"""
+    payer = rng.choice(members)
+    payees = rng.sample(members, rng.randint(1, min(max_fanout, len(members))))
+    shares = [Decimal(rng.randint(100, 20_000)).scaleb(-2) for _ in payees]
+    is_session = rng.random() < session_ratio
+    return TransactionPost(
+        description=f"Expense {index}",
+        amount=sum(shares),
+        transaction_date=day,
+        category=rng.choice(CATEGORIES),
+        is_session=is_session,
+        # Most sessions are closed, the rest show up as active sessions for every member
+        is_session_closed=is_session and rng.random() < 0.9,
+        group_id=group_id,
+        breakdowns=[Breakdown(payer=payer, payee=payee, amount=share, item_detail={}) for payee, share in zip(payees, shares)],
+    )
+
+
+def seed(conn: Session, args: argparse.Namespace, rng: random.Random) -> dict:
+    password = CryptContext(schemes=["bcrypt"]).hash(args.password)
+    usernames = [f"{args.prefix}_{index}" for index in range(args.users)]
+    users = dict(conn.execute(insert(User.__table__).values([  # type: ignore
+        {"name": f"User {index}", "username": username, "email": f"{username}@example.com", "password": password, "push_on": False, "email_on": False}
+        for index, username in enumerate(usernames)
+    ]).returning(User.__table__.c.username, User.__table__.c.id)).all())  # type: ignore
+    user_ids = [users[username] for username in usernames]
+    group_ids = conn.execute(insert(Group.__table__).values([  # type: ignore
+        {"name": f"{args.prefix} group {index}", "type": "General", "deleted": False, "version": 0} for index in range(args.groups)
+    ]).returning(Group.__table__.c.id)).scalars().all()  # type: ignore
+
+    memberships = {group_id: rng.sample(user_ids, min(args.members, len(user_ids))) for group_id in group_ids}
+    conn.execute(insert(UserGroupLink.__table__), [  # type: ignore
+        {"group_id": group_id, "user_id": user_id} for group_id, members in memberships.items() for user_id in members
+    ])
+    conn.commit()
+
+    start = date.today() - timedelta(days=args.days)
+    # bulk_create only needs a caller for its events, any seeded user will do
+    session = SessionData(conn=conn, user_id=user_ids[0])
+    for offset in range(0, args.transactions, BATCH):
+        rows = []
+        for index in range(offset, min(offset + BATCH, args.transactions)):
+            group_id = rng.choice(group_ids)
+            day = start + timedelta(days=rng.randrange(args.days))
+            rows.append(make_transaction(group_id, memberships[group_id], args.fanout, day, index, rng, args.session_ratio))
+        Transaction.bulk_create(rows, session)
+        print(f"{offset + len(rows)}/{args.transactions} transactions")
+
+    return {
+        "seed": args.seed,
+        "password": args.password,
+        "users": users,
+        "groups": {str(group_id): members for group_id, members in memberships.items()},
+        "scale": {"users": args.users, "groups": args.groups, "members": args.members, "transactions": args.transactions, "fanout": args.fanout},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.seed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--members", type=int, default=8, help="Members per group")
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--fanout", type=int, default=4, help="Most payees in one transaction")
+    parser.add_argument("--days", type=int, default=365, help="Transactions are spread over this many days up to today")
+    parser.add_argument("--session-ratio", type=float, default=0.05)
+    parser.add_argument("--prefix", default="bench", help="Username prefix, change it to seed the same database twice")
+    parser.add_argument("--password", default="benchmark")
+    parser.add_argument("--manifest", default="seed.json")
+    args = parser.parse_args()
+
+    create_tables()
+    with Session(get_engine()) as conn:
+        manifest = seed(conn, args, random.Random(args.seed))
+
+    with open(args.manifest, "w") as file:
+        json.dump(manifest, file)
+    print(f"Seeded {args.users} users, {args.groups} groups and {args.transactions} transactions, manifest in {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compares the list endpoint serialization paths without a database.
+
+The current path validates ORM Transactions against response_model=list[Transaction] and runs jsonable_encoder,
+the fast path encodes TransactionRow read models directly.
+
+Run from the ``src`` directory: ``python -m benchmarks.serialization``
+"""
+import argparse
+import json
+import time
+from dataclasses import astuple
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from database import Transaction
+from database.models.transactions import TransactionRow
+from api.model.response import encode_json
+
+SIZES = [1_000, 10_000, 100_000]
+
+
+def make_rows(count: int) -> list[TransactionRow]:
+    now = datetime.utcnow()
+    return [
+        TransactionRow(
+            id=index, description=f"Transaction {index}", amount=Decimal("123.45"),
+            transaction_date=date(2020, 1, 1) + timedelta(days=index % 1000), category="General", sub_category="Others",
+            notes=None, details={"merchant": "Shop", "items": 3}, is_session=False, is_session_closed=False,
+            is_itemized=False, group_id=1, created_at=now, updated_at=now,
+        )
+        for index in range(count)
+    ]
+
+
+def orm_path(transactions: list[Transaction]) -> bytes:
+    validated = parse_obj_as(list[Transaction], transactions)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'orm ms':>10} {'fast ms':>10} {'speedup':>8}")
+    for size in args.sizes:
+        rows = make_rows(size)
+        names = TransactionRow.__slots__
+        transactions = [Transaction(**dict(zip(names, astuple(x)))) for x in rows]
+
+        orm_seconds = timed(orm_path, transactions)
+        fast_seconds = timed(encode_json, rows)
+        print(f"{size:>8} {orm_seconds * 1000:>10.1f} {fast_seconds * 1000:>10.1f} {orm_seconds / fast_seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Times debt simplification over randomized group balances.
+
+Run from the ``src`` directory: ``python -m benchmarks.simplify``
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+from database.models.link_model.journal import Balance, simplify, OPTIMAL_MAX_MEMBERS
+
+SIZES = [10, 100, 1_000, 10_000]
+
+
+def random_balance(members: int, rng: random.Random) -> list[Balance]:
+    """Random balances in cents that sum to zero"""
+    cents = [rng.randint(-50_000, 50_000) for _ in range(members - 1)]
+    cents.append(-sum(cents))
+    return [Balance(user_id=user_id, amount=Decimal(amount).scaleb(-2)) for user_id, amount in enumerate(cents)]
+
+
+def timed(balance: list[Balance], optimal: bool, repeat: int) -> tuple[float, int]:
+    """Best wall time in seconds over repeat runs, and the number of transfers in the plan"""
+    best = float("inf")
+    transfers = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plan = simplify(balance, optimal)
+        best = min(best, time.perf_counter() - start)
+        transfers = len(plan)
+    return best, transfers
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.simplify")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print(f"{'members':>8} {'mode':>8} {'best ms':>10} {'transfers':>10}")
+    for members in SIZES:
+        balance = random_balance(members, rng)
+        seconds, transfers = timed(balance, False, args.repeat)
+        print(f"{members:>8} {'greedy':>8} {seconds * 1000:>10.3f} {transfers:>10}")
+
+    balance = random_balance(OPTIMAL_MAX_MEMBERS, rng)
+    for optimal in (False, True):
+        seconds, transfers = timed(balance, optimal, args.repeat)
+        print(f"{OPTIMAL_MAX_MEMBERS:>8} {'optimal' if optimal else 'greedy':>8} {seconds * 1000:>10.3f} {transfers:>10}")
+
+
+if __name__ == "__main__":
+    main()
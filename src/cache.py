@@ -0,0 +1,139 @@
+"""
+Cache for derived read views, kept fresh by the change events in events.py.
+
+The backend is an in-process LRU by default, or any Redis protocol server when cache_url is set.
+Values are stored as JSON so both backends behave the same.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Callable
+import events
+from settings import get_settings
+
+
+def _encode_decimal(value: Any) -> str:
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class LRUBackend:
+    """Thread safe in-process LRU, entries expire ttl seconds after they are stored"""
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, keys: list[str]):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Backend for any Redis protocol server. Takes a redis-py compatible client, so tests can pass a local stand-in."""
+    def __init__(self, client):
+        self._client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        import redis
+        return cls(redis.Redis.from_url(url, decode_responses=True))
+
+    def get(self, key: str) -> str | None:
+        return self._client.get(key)
+
+    def set(self, key: str, value: str, ttl: float):
+        self._client.set(key, value, px=int(ttl * 1000))
+
+    def delete(self, keys: list[str]):
+        if keys:
+            self._client.delete(*keys)
+
+
+class Cache:
+    def __init__(self, backend: LRUBackend | RedisBackend, default_ttl: float):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._hits: dict[str, int] = {}
+        self._misses: dict[str, int] = {}
+
+    def _count(self, counts: dict[str, int], key: str):
+        view = key.split(":", 1)[0]
+        with self._lock:
+            counts[view] = counts.get(view, 0) + 1
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl: float | None = None) -> Any:
+        """
+        Returns the cached value for key, computing and storing it on a miss.
+
+        Values must be JSON serializable, Decimals are stored as strings and come back as strings.
+        """
+        cached = self.backend.get(key)
+        if cached is not None:
+            self._count(self._hits, key)
+            return json.loads(cached)
+
+        self._count(self._misses, key)
+        value = compute()
+        self.backend.set(key, json.dumps(value, default=_encode_decimal), ttl if ttl is not None else self.default_ttl)
+        return value
+
+    def invalidate(self, keys: list[str]):
+        self.backend.delete(keys)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Hit and miss counts per view, the view being the key prefix before the first colon"""
+        with self._lock:
+            return {view: {"hits": self._hits.get(view, 0), "misses": self._misses.get(view, 0)} for view in self._hits.keys() | self._misses.keys()}
+
+
+def overview_key(user_id: int) -> str:
+    return f"overview:{user_id}"
+
+def settlement_key(group_id: int, optimal: bool) -> str:
+    return f"settlement:{group_id}:{int(optimal)}"
+
+def recent_write_key(user_id: int) -> str:
+    return f"recent_write:{user_id}"
+
+
+@lru_cache()
+def get_cache() -> Cache:
+    settings = get_settings()
+    backend = RedisBackend.from_url(settings.cache_url) if settings.cache_url else LRUBackend(settings.cache_size)
+    return Cache(backend, settings.cache_ttl)
+
+
+def _invalidate(event: str, group_ids: list[int], user_ids: list[int], **payload):
+    keys = [overview_key(x) for x in user_ids]
+    if event == events.TRANSACTIONS_CHANGED:
+        keys += [settlement_key(x, optimal) for x in group_ids for optimal in (False, True)]
+    get_cache().invalidate(keys)
+
+
+events.subscribe(events.TRANSACTIONS_CHANGED, _invalidate)
+events.subscribe(events.MEMBERSHIP_CHANGED, _invalidate)
@@ -10,4 +10,10 @@ class TransactionDoesNotExistError(Exception):
     pass
 
 class JournalDoesNotExistError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class IdempotencyKeyReusedError(Exception):
+    pass
+
+class InvalidBreakdownError(ValueError):
+    pass
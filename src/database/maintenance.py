@@ -0,0 +1,220 @@
+"""
+Maintenance jobs for derived tables.
+
+Run from the ``src`` directory, e.g. ``python -m database.maintenance check-balances``
+
+Indexes added to the models are only created with their table. After deploying a model change that adds an
+index, run ``python -m database.maintenance create-indexes`` to build it without blocking writes.
+"""
+import argparse
+import re
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import select, func, union_all, delete, text, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import Session, SQLModel
+from . import get_engine
+from .models.transactions import Transaction
+from .models.groups import Group
+from .models.link_model import Journal, UserBalance, UserGroupBalance, BalanceSnapshot
+from .models.idempotency import IdempotencyKey
+from settings import get_settings
+from storage import get_blob_store
+
+
+def _group_balance_query():
+    """Net balance per (group, user) and the settled part of it, computed directly from the journals"""
+    closed = or_(Transaction.is_session == False, Transaction.is_session_closed == True).label("closed")
+    signed = union_all(
+        select(Transaction.group_id, Journal.payer_id.label("user_id"), Journal.amount.label("amount"), closed)
+            .join(Transaction, Journal.transaction_id == Transaction.id),
+        select(Transaction.group_id, Journal.payee_id.label("user_id"), (-Journal.amount).label("amount"), closed)
+            .join(Transaction, Journal.transaction_id == Transaction.id),
+    ).subquery()
+
+    amount = func.sum(signed.c.amount)
+    settled = func.coalesce(func.sum(signed.c.amount).filter(signed.c.closed), 0)
+    return (
+        select(signed.c.group_id, signed.c.user_id, amount.label("amount"), settled.label("settled"))
+        .group_by(signed.c.group_id, signed.c.user_id)
+        .having(or_(amount != 0, settled != 0))
+    )
+
+
+def rebuild_balances(session: Session):
+    """Rebuilds the running balance tables from the journals"""
+    # Blocks journal writes and session closes (but not reads) until the rebuild commits
+    session.execute(text('LOCK TABLE journal, "transaction" IN SHARE MODE'))
+
+    group_table = UserGroupBalance.__table__  # type: ignore
+    user_table = UserBalance.__table__  # type: ignore
+
+    session.execute(delete(group_table))
+    session.execute(delete(user_table))
+    session.execute(group_table.insert().from_select(["group_id", "user_id", "amount", "settled"], _group_balance_query()))
+    session.execute(user_table.insert().from_select(
+        ["user_id", "amount"],
+        select(group_table.c.user_id, func.sum(group_table.c.amount)).group_by(group_table.c.user_id),
+    ))
+    session.commit()
+
+
+def check_balances(session: Session) -> list[tuple[int | None, int, Decimal, Decimal]]:
+    """
+    Compares the running balances, and the settled part of the group balances, against the journals.
+
+    Returns a list of (group_id, user_id, expected, stored) for every mismatch. group_id is None for the per user totals.
+    """
+    expected_group: dict[tuple[int, int], tuple[Decimal, Decimal]] = {}
+    expected_user: dict[int, Decimal] = {}
+    for group_id, user_id, amount, settled in session.execute(_group_balance_query()):
+        expected_group[(group_id, user_id)] = (amount, settled)
+        expected_user[user_id] = expected_user.get(user_id, Decimal(0)) + amount
+
+    stored_group = {
+        (x.group_id, x.user_id): (x.amount, x.settled)
+        for x in session.execute(select(UserGroupBalance.group_id, UserGroupBalance.user_id, UserGroupBalance.amount, UserGroupBalance.settled))
+    }
+    stored_user = {x.user_id: x.amount for x in session.execute(select(UserBalance.user_id, UserBalance.amount))}
+
+    mismatches = []
+    zero = (Decimal(0), Decimal(0))
+    for key in sorted(expected_group.keys() | stored_group.keys()):
+        expected, stored = expected_group.get(key, zero), stored_group.get(key, zero)
+        if expected[0] != stored[0]:
+            mismatches.append((key[0], key[1], expected[0], stored[0]))
+        elif expected[1] != stored[1]:
+            # Reported against the settled column, so the amounts shown are the settled ones
+            mismatches.append((key[0], key[1], expected[1], stored[1]))
+
+    for user_id in sorted(expected_user.keys() | stored_user.keys()):
+        expected, stored = expected_user.get(user_id, Decimal(0)), stored_user.get(user_id, Decimal(0))
+        if expected != stored:
+            mismatches.append((None, user_id, expected, stored))
+
+    return mismatches
+
+
+def migrate_group_images(session: Session) -> int:
+    """
+    Moves images left in the legacy group.image column into the blob store.
+
+    Each migrated row gets its image_hash set and the column cleared. Drop the column once this reports nothing left.
+    """
+    store = get_blob_store()
+    rows = session.execute(text('SELECT id, image FROM "group" WHERE image IS NOT NULL')).all()
+    for group_id, image in rows:
+        digest = store.put(bytes(image))
+        session.execute(text('UPDATE "group" SET image_hash = :digest, image = NULL WHERE id = :id'), {"digest": digest, "id": group_id})
+        session.commit()
+    return len(rows)
+
+
+def snapshot_balances(session: Session, as_of: date) -> int:
+    """
+    Checkpoints every group's balances as of the given date, each from its previous checkpoint.
+
+    Each group's row is locked first, the lock Group.bump_version takes. Writes in flight commit before the balances
+    are read, and writes that start later wait for the checkpoint to commit before dropping it with invalidate_from.
+    """
+    group_ids = session.execute(select(Group.id)).scalars().all()
+    for group_id in group_ids:
+        session.execute(select(Group.id).where(Group.id == group_id).with_for_update())
+        BalanceSnapshot.save(group_id, as_of, Transaction.get_group_balance_as_of(group_id, as_of, session), session)
+        session.commit()
+    return len(group_ids)
+
+
+# Index name -> the model index that replaced it, dropped once the replacement exists
+SUPERSEDED_INDEXES = {
+    "ix_transaction_group_id": "ix_transaction_group_id_transaction_date_id",
+    "ix_transaction_group_id_closed": "ix_transaction_group_id_transaction_date_id",
+}
+
+
+def create_indexes(engine: Engine) -> list[str]:
+    """
+    Builds the model indexes missing from the database with CREATE INDEX CONCURRENTLY, then drops superseded ones.
+
+    Concurrent builds do not block writes but cannot run in a transaction, so each statement runs in autocommit.
+    A build that fails leaves an INVALID index behind, drop it and run this again. Returns the statements run.
+    """
+    statements = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        existing = set(conn.execute(text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")).scalars())
+        for table in SQLModel.metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda x: x.name):
+                if index.name not in existing:
+                    statement = str(CreateIndex(index).compile(dialect=conn.dialect))
+                    statements.append(re.sub(r"^CREATE (UNIQUE )?INDEX ", r"CREATE \1INDEX CONCURRENTLY IF NOT EXISTS ", statement))
+                    conn.execute(text(statements[-1]))
+                    existing.add(index.name)
+
+        for name, replacement in SUPERSEDED_INDEXES.items():
+            if name in existing and replacement in existing:
+                statements.append(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+                conn.execute(text(statements[-1]))
+    return statements
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m database.maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check-balances", help="Compare the running balances against the journals")
+    check.add_argument("--fix", action="store_true", help="Rebuild the balances if a mismatch is found")
+    commands.add_parser("rebuild-balances", help="Rebuild the running balances from the journals")
+    sweep = commands.add_parser("sweep-idempotency-keys", help="Delete idempotency keys past their TTL")
+    sweep.add_argument("--ttl-hours", type=int, default=get_settings().idempotency_key_ttl_hours)
+    commands.add_parser("migrate-group-images", help="Move images out of the legacy group.image column into the blob store")
+    snapshot = commands.add_parser("snapshot-balances", help="Checkpoint every group's balances, run daily")
+    snapshot.add_argument("--as-of", type=date.fromisoformat, default=date.today() - timedelta(days=1), help="Defaults to yesterday")
+    commands.add_parser("create-indexes", help="Build missing model indexes with CREATE INDEX CONCURRENTLY, run after deploying new indexes")
+    args = parser.parse_args(argv)
+
+    if args.command == "create-indexes":
+        statements = create_indexes(get_engine())
+        for statement in statements:
+            print(statement)
+        print(f"Ran {len(statements)} index statement(s)")
+        return 0
+
+    with Session(get_engine()) as session:
+        if args.command == "snapshot-balances":
+            print(f"Checkpointed {snapshot_balances(session, args.as_of)} group(s) as of {args.as_of}")
+            return 0
+
+        if args.command == "migrate-group-images":
+            print(f"Migrated {migrate_group_images(session)} group image(s)")
+            return 0
+
+        if args.command == "sweep-idempotency-keys":
+            removed = IdempotencyKey.sweep(timedelta(hours=args.ttl_hours), session)
+            print(f"Removed {removed} idempotency key(s)")
+            return 0
+
+        if args.command == "rebuild-balances":
+            rebuild_balances(session)
+            print("Balances rebuilt")
+            return 0
+
+        mismatches = check_balances(session)
+        for group_id, user_id, expected, stored in mismatches:
+            scope = f"group {group_id}" if group_id is not None else "total"
+            print(f"user {user_id} ({scope}): expected {expected}, stored {stored}")
+
+        if not mismatches:
+            print("Balances are consistent")
+            return 0
+
+        if args.fix:
+            rebuild_balances(session)
+            print(f"Rebuilt balances after {len(mismatches)} mismatch(es)")
+            return 0
+
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
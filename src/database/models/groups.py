@@ -1,26 +1,31 @@
-from sqlmodel import Field, Relationship, SQLModel, select
+from sqlmodel import Field, Relationship, SQLModel, Session, select
 from datetime import datetime
-from sqlalchemy import Column, DateTime, LargeBinary
+from sqlalchemy import Column, DateTime, update
+from sqlalchemy.exc import IntegrityError
 from typing import TYPE_CHECKING, List
 from .link_model import UserGroupLink
+from .users import User, UserResponse
 from ..errors import GroupDoesNotExistError
 from .types import SessionData
-from api.model.response import UserResponse
+from storage import get_blob_store
+import events
 
 
 if TYPE_CHECKING:
-    from .users import User
     from .transactions import Transaction
     from api.model.request import GroupPost
 
 class Group(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
     name: str
-    image: bytes = Field(default= None, sa_column=Column(LargeBinary()))
+    # sha256 of the image in the blob store, the bytes never live on the group row
+    image_hash: str | None = Field(default=None, max_length=64)
     type: str = Field(default="General")
     created_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), default=datetime.utcnow))
     deleted_at: datetime | None = Field(default=None, sa_column=Column(DateTime(timezone=True), default=None))
     deleted: bool = False
+    # Bumped by every write that changes the group's balances, derived data keyed on it goes stale on bump
+    version: int = Field(default=0, nullable=False)
 
     # Foreign Attributes
     users: List["User"] = Relationship(back_populates="groups", link_model=UserGroupLink)
@@ -33,22 +38,132 @@ class Group(SQLModel, table=True):
             raise GroupDoesNotExistError(f"Group with id {group_id} does not exist")
         return group
 
+    @classmethod
+    def check_member(cls, group_id: int, session: SessionData):
+        """Raises GroupDoesNotExistError unless the group exists and the user is a member of it"""
+        link = session.conn.exec(select(UserGroupLink).where(UserGroupLink.group_id == group_id, UserGroupLink.user_id == session.user_id)).first()
+        if not link:
+            raise GroupDoesNotExistError(f"Group with id {group_id} does not exist")
+
+    @classmethod
+    def check_ids(cls, group_ids: list[int], conn: Session):
+        """Raises GroupDoesNotExistError unless every id is a group, reading only the ids"""
+        found = set(conn.exec(select(Group.id).where(Group.id.in_(group_ids))).all())  # type: ignore
+        missing = sorted(set(group_ids) - found)
+        if missing:
+            raise GroupDoesNotExistError(f"Group with id(s) {missing} does not exist")
+
+    @classmethod
+    def add_members(cls, group_id: int, user_ids: list[int], conn: Session) -> list[int]:
+        """Adds users to a group in one statement, returning the ids that were not members yet"""
+        cls.check_ids([group_id], conn)
+        User.check_ids(user_ids, conn)
+        added = [user_id for _, user_id in cls._link([(group_id, x) for x in set(user_ids)], conn)]
+        conn.commit()
+        if added:
+            events.emit(events.MEMBERSHIP_CHANGED, group_ids=[group_id], user_ids=added)
+        return sorted(added)
+
+    @classmethod
+    def _link(cls, pairs: list[tuple[int, int]], conn: Session) -> list[tuple[int, int]]:
+        """
+        UserGroupLink.link, for pairs that were already validated.
+
+        A group or user deleted since then fails the foreign key, it is reported with the validation's own error.
+        """
+        try:
+            return UserGroupLink.link(pairs, conn)
+        except IntegrityError:
+            conn.rollback()
+            cls.check_ids(list({x[0] for x in pairs}), conn)
+            User.check_ids(list({x[1] for x in pairs}), conn)
+            raise
+
+    @classmethod
+    def remove_members(cls, group_id: int, user_ids: list[int], conn: Session) -> list[int]:
+        """Removes users from a group in one statement, returning the ids that were members"""
+        removed = [user_id for _, user_id in UserGroupLink.unlink([(group_id, x) for x in set(user_ids)], conn)]
+        conn.commit()
+        if removed:
+            events.emit(events.MEMBERSHIP_CHANGED, group_ids=[group_id], user_ids=removed)
+        return sorted(removed)
+
+    @classmethod
+    def join(cls, user_id: int, group_ids: list[int], conn: Session) -> list[int]:
+        """Adds a user to many groups in one statement, returning the ids of the groups joined"""
+        cls.check_ids(group_ids, conn)
+        joined = [group_id for group_id, _ in cls._link([(x, user_id) for x in set(group_ids)], conn)]
+        conn.commit()
+        if joined:
+            events.emit(events.MEMBERSHIP_CHANGED, group_ids=joined, user_ids=[user_id])
+        return sorted(joined)
+
+    @classmethod
+    def leave(cls, user_id: int, group_ids: list[int], conn: Session) -> list[int]:
+        """Removes a user from many groups in one statement, returning the ids of the groups left"""
+        left = [group_id for group_id, _ in UserGroupLink.unlink([(x, user_id) for x in set(group_ids)], conn)]
+        conn.commit()
+        if left:
+            events.emit(events.MEMBERSHIP_CHANGED, group_ids=left, user_ids=[user_id])
+        return sorted(left)
+
+    @classmethod
+    def get_member_ids(cls, group_id: int, conn: Session) -> list[int]:
+        return list(conn.exec(select(UserGroupLink.user_id).where(UserGroupLink.group_id == group_id)).all())  # type: ignore
+
+    @classmethod
+    def get_image_hash(cls, group_id: int, session: SessionData) -> str | None:
+        """Image digest of a group the user is a member of, raises GroupDoesNotExistError for any other group"""
+        row = session.conn.exec(
+            select(Group.id, Group.image_hash)
+            .join(UserGroupLink, UserGroupLink.group_id == Group.id)
+            .where(Group.id == group_id, UserGroupLink.user_id == session.user_id)
+        ).first()
+        if not row:
+            raise GroupDoesNotExistError(f"Group with id {group_id} does not exist")
+        return row.image_hash
+
+    @classmethod
+    def set_image(cls, group_id: int, image: bytes, session: SessionData):
+        cls.get_image_hash(group_id, session)
+        digest = get_blob_store().put(image)
+        session.conn.execute(update(Group).where(Group.id == group_id).values(image_hash=digest))
+        session.conn.commit()
+
+    @classmethod
+    def bump_version(cls, group_ids: list[int], conn: Session):
+        """
+        Marks derived data of the groups as stale. Does not commit.
+
+        This is the first lock every balance write takes. Several groups are locked in id order, so two writers
+        bumping overlapping groups cannot deadlock.
+        """
+        if len(group_ids) > 1:
+            conn.execute(select(Group.id).where(Group.id.in_(group_ids)).order_by(Group.id).with_for_update())  # type: ignore
+        conn.execute(update(Group).where(Group.id.in_(group_ids)).values(version=Group.version + 1))  # type: ignore
+
     @classmethod
     def create_group(cls, data: "GroupPost", session: SessionData) -> int:
         group = Group(name=data.name, type=data.type)
         if data.image:
-            group.image = data.image
+            group.image_hash = get_blob_store().put(data.image)
 
         session.conn.add(group)
         session.user.groups.append(group)
         session.conn.commit()
         session.conn.refresh(group)
+        events.emit(events.MEMBERSHIP_CHANGED, group_ids=[group.id], user_ids=[session.user_id])  # type: ignore
         return group.id # type: ignore
 
     @classmethod
     def get_users(cls, group_id: int, session: SessionData):
-        group = cls.get_by_id(group_id, session)
-        users: list[UserResponse] = []
-        for user in group.users:
-            users.append(UserResponse(id=user.id, name=user.name, push_on=user.push_on, email_on=user.email_on)) # type: ignore
-        return users
\ No newline at end of file
+        """Members of the group, read as plain columns without loading the group or the users"""
+        rows = session.conn.exec(
+            select(User.id, User.name, User.push_on, User.email_on)
+            .join(UserGroupLink, UserGroupLink.user_id == User.id)
+            .where(UserGroupLink.group_id == group_id)
+        ).all()
+        if not rows and not session.conn.exec(select(Group.id).where(Group.id == group_id)).first():
+            raise GroupDoesNotExistError(f"Group with id {group_id} does not exist")
+
+        return [UserResponse(id=x.id, name=x.name, push_on=x.push_on, email_on=x.email_on) for x in rows]
\ No newline at end of file
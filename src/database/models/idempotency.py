@@ -0,0 +1,46 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from sqlmodel import Field, SQLModel, Session, select
+from sqlalchemy import Column, DateTime, delete, func
+from ..errors import IdempotencyKeyReusedError
+
+if TYPE_CHECKING:
+    from api.model.request import TransactionPost
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """Outcome of a request made with an Idempotency-Key header, replayed when the client retries"""
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    key: str = Field(primary_key=True, max_length=255)
+    request_hash: str
+    transaction_id: int = Field(foreign_key="transaction.id")
+    created_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), default=datetime.utcnow, index=True))
+
+    @staticmethod
+    def hash_request(data: "TransactionPost") -> str:
+        return hashlib.sha256(data.json(sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def claim(cls, user_id: int, key: str, data: "TransactionPost", conn: Session) -> int | None:
+        """
+        Serializes requests sharing a key and returns the transaction id of an earlier request, if any.
+
+        Takes a transaction scoped advisory lock, so a concurrent duplicate waits here until the first request commits
+        and then sees its stored result. Raises IdempotencyKeyReusedError if the key was used for a different request.
+        """
+        conn.execute(select(func.pg_advisory_xact_lock(user_id, func.hashtext(key))))
+        stored = conn.exec(select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)).first()
+        if stored is None:
+            return None
+
+        if stored.request_hash != cls.hash_request(data):
+            raise IdempotencyKeyReusedError(f"Idempotency key {key} was already used for a different request")
+        return stored.transaction_id
+
+    @classmethod
+    def sweep(cls, ttl: timedelta, conn: Session) -> int:
+        """Deletes keys older than ttl, returning how many were removed"""
+        result = conn.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - ttl))  # type: ignore
+        conn.commit()
+        return result.rowcount
@@ -1,2 +1,3 @@
 from .user_group import UserGroupLink
-from .journal import Journal
\ No newline at end of file
+from .balance import UserBalance, UserGroupBalance, BalanceSnapshot
+from .journal import Journal
@@ -0,0 +1,127 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable
+from sqlmodel import Field, SQLModel, Session, select
+from sqlalchemy import Column, DateTime, Index, delete
+from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.dialects.postgresql import insert
+from datetime import date, datetime
+from ..types import Money
+
+# (payer_id, payee_id, amount) of a single journal entry
+JournalEntry = tuple[int, int, Decimal]
+
+
+class UserBalance(SQLModel, table=True):
+    """Running net balance of a user across all groups. Positive means the user is owed money."""
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    amount: Money = Field(default=Decimal(0))
+    updated_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), onupdate=datetime.utcnow, default=datetime.utcnow))
+
+
+class UserGroupBalance(SQLModel, table=True):
+    """Running net balance of a user within a single group"""
+    __table_args__ = (
+        # The primary key leads with user_id, group reads (balances, settlement plans) need their own index
+        Index("ix_usergroupbalance_group_id", "group_id"),
+    )
+
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    group_id: int = Field(foreign_key="group.id", primary_key=True)
+    amount: Money = Field(default=Decimal(0))
+    # The part of amount from closed transactions (everything but open sessions), which settlement plans are made from
+    settled: Money = Field(default=Decimal(0))
+    updated_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), onupdate=datetime.utcnow, default=datetime.utcnow))
+
+
+class BalanceSnapshot(SQLModel, table=True):
+    """Checkpoint of every member's net balance in a group, including all transactions dated up to as_of"""
+    group_id: int = Field(foreign_key="group.id", primary_key=True)
+    as_of: date = Field(primary_key=True)
+    # user_id -> amount, both as strings
+    balances: Dict[str, Any] = Field(sa_column=Column(psql.JSONB(), nullable=False))
+    created_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), default=datetime.utcnow))
+
+    def amounts(self) -> dict[int, Decimal]:
+        return {int(user_id): Decimal(amount) for user_id, amount in self.balances.items()}
+
+    @classmethod
+    def latest(cls, group_id: int, as_of: date, conn: Session) -> "BalanceSnapshot | None":
+        """The most recent checkpoint taken at or before as_of"""
+        return conn.exec(
+            select(BalanceSnapshot)
+            .where(BalanceSnapshot.group_id == group_id, BalanceSnapshot.as_of <= as_of)
+            .order_by(BalanceSnapshot.as_of.desc())  # type: ignore
+            .limit(1)
+        ).first()
+
+    @classmethod
+    def save(cls, group_id: int, as_of: date, amounts: dict[int, Decimal], conn: Session):
+        """Stores or replaces the checkpoint. Does not commit."""
+        balances = {str(user_id): str(amount) for user_id, amount in amounts.items() if amount != 0}
+        stmt = insert(BalanceSnapshot.__table__).values(group_id=group_id, as_of=as_of, balances=balances, created_at=datetime.utcnow())  # type: ignore
+        conn.execute(stmt.on_conflict_do_update(index_elements=["group_id", "as_of"], set_={"balances": balances, "created_at": datetime.utcnow()}))
+
+    @classmethod
+    def invalidate_from(cls, group_id: int, transaction_date: date, conn: Session):
+        """Drops checkpoints that a transaction dated transaction_date would have been part of. Does not commit."""
+        conn.execute(delete(BalanceSnapshot).where(BalanceSnapshot.group_id == group_id, BalanceSnapshot.as_of >= transaction_date))  # type: ignore
+
+
+def journal_deltas(entries: Iterable[JournalEntry]) -> dict[int, Decimal]:
+    """Nets journal entries into a balance change per user, dropping users whose balance does not move"""
+    deltas: dict[int, Decimal] = defaultdict(Decimal)
+    for payer_id, payee_id, amount in entries:
+        deltas[payer_id] += amount
+        deltas[payee_id] -= amount
+
+    return {user_id: amount for user_id, amount in deltas.items() if amount != 0}
+
+
+def apply_journal_deltas(group_id: int, entries: Iterable[JournalEntry], conn: Session, settled: bool):
+    """
+    Folds journal entries into the running balances, and into the group's settled balance when they belong to closed transactions.
+
+    Does not commit, so the balance update lands in the same database transaction as the journal write.
+    Rows are upserted in user_id order: user balances are shared by every group, and writers that lock them in
+    the same order cannot deadlock.
+    """
+    deltas = sorted(journal_deltas(entries).items())
+    if not deltas:
+        return
+
+    user_table = UserBalance.__table__  # type: ignore
+    stmt = insert(user_table).values([{"user_id": user_id, "amount": amount} for user_id, amount in deltas])
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[user_table.c.user_id],
+        set_={"amount": user_table.c.amount + stmt.excluded.amount, "updated_at": datetime.utcnow()},
+    ))
+
+    group_table = UserGroupBalance.__table__  # type: ignore
+    stmt = insert(group_table).values([
+        {"user_id": user_id, "group_id": group_id, "amount": amount, "settled": amount if settled else Decimal(0)}
+        for user_id, amount in deltas
+    ])
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[group_table.c.user_id, group_table.c.group_id],
+        set_={"amount": group_table.c.amount + stmt.excluded.amount, "settled": group_table.c.settled + stmt.excluded.settled, "updated_at": datetime.utcnow()},
+    ))
+
+
+def settle_journal_deltas(group_id: int, entries: Iterable[JournalEntry], conn: Session):
+    """
+    Folds the journal entries of sessions that were just closed into the group's settled balance.
+
+    Their amounts are already part of the running balances, so only settled moves. Does not commit.
+    Rows are upserted in user_id order, like apply_journal_deltas.
+    """
+    deltas = sorted(journal_deltas(entries).items())
+    if not deltas:
+        return
+
+    group_table = UserGroupBalance.__table__  # type: ignore
+    stmt = insert(group_table).values([{"user_id": user_id, "group_id": group_id, "amount": Decimal(0), "settled": amount} for user_id, amount in deltas])
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[group_table.c.user_id, group_table.c.group_id],
+        set_={"settled": group_table.c.settled + stmt.excluded.settled, "updated_at": datetime.utcnow()},
+    ))
@@ -1,12 +1,13 @@
+import heapq
 from decimal import Decimal
 from typing import TYPE_CHECKING, Any, Dict
 from pydantic import BaseModel
 from sqlmodel import Field, Relationship, SQLModel, Session, select
-from sqlalchemy import Column, DateTime
+from sqlalchemy import Column, DateTime, func, union_all
 from datetime import datetime
 from sqlalchemy.dialects import postgresql as psql
-from api.model.response import PayStructResponse
 from ..types import Money, SessionData
+from .balance import UserBalance
 from ...errors import JournalDoesNotExistError
 
 if TYPE_CHECKING:
@@ -20,6 +21,14 @@ class Balance(BaseModel):
     def __str__(self) -> str:
         return f"{self.user_id}: {self.amount}"
 
+class PayStructResponse(BaseModel):
+    debtor_id: int
+    debtee_id: int
+    amount: Decimal
+
+    def __str__(self) -> str:
+        return f"{self.debtee_id} -> {self.amount} -> {self.debtor_id}"
+
 class JournalBase(SQLModel):
     transaction_id: int | None = Field(default=None, foreign_key="transaction.id", primary_key=True)
     amount: Money
@@ -43,16 +52,30 @@ class Journal(JournalBase, table=True):
 
     @classmethod
     def get_user_balance(cls, session: SessionData) -> Decimal:
-        payer_journals = session.conn.exec(select(Journal).where(Journal.payer == session.user)).all()
-        payee_journals = session.conn.exec(select(Journal).where(Journal.payee == session.user)).all()
+        """Reads the user's running balance, which is maintained on every journal write"""
+        balance = session.conn.exec(select(UserBalance.amount).where(UserBalance.user_id == session.user_id)).first()
+        if balance is None:
+            return Decimal(0)
+        return Decimal(balance)
 
-        lent = sum([x.amount for x in payer_journals])
-        borrowed = sum([x.amount for x in payee_journals])
+    @classmethod
+    def get_users_balance(cls, transaction_ids: list[int], session: SessionData) -> list[Balance]:
+        """Net balance per user over the given transactions, aggregated by the database"""
+        signed = union_all(
+            select(Journal.payer_id.label("user_id"), Journal.amount.label("amount")).where(Journal.transaction_id.in_(transaction_ids)),  # type: ignore
+            select(Journal.payee_id.label("user_id"), (-Journal.amount).label("amount")).where(Journal.transaction_id.in_(transaction_ids)),  # type: ignore
+        ).subquery()
+        rows = session.conn.exec(select(signed.c.user_id, func.sum(signed.c.amount)).group_by(signed.c.user_id)).all()
 
-        return Decimal(lent - borrowed)
+        return [Balance(user_id=user_id, amount=amount) for user_id, amount in rows]
 
     @classmethod
-    def get_users_debt(cls, transaction_ids: list[int], session: SessionData):
+    def get_users_balance_reference(cls, transaction_ids: list[int], session: SessionData) -> list[Balance]:
+        """
+        Reference implementation of get_users_balance that sums the journals in Python.
+
+        Kept to cross check the SQL aggregation, do not use it on a request path.
+        """
         journals = session.conn.exec(select(Journal).where(Journal.transaction_id.in_(transaction_ids))).all() # type: ignore
 
         members = [x.payer_id for x in journals]
@@ -65,33 +88,113 @@ class Journal(JournalBase, table=True):
             credits = sum([x.amount for x in journals if x.payee_id == user_id], start=Decimal(0))
             balance.append(Balance(user_id=user_id, amount=(debits-credits)))
 
-        return simplify(balance)
+        return balance
 
-def simplify(balance: list[Balance]):
-    pay_tree = []
-    total = sum([x.amount for x in balance], start=Decimal(0))
-
-    if total != 0:
+    @classmethod
+    def get_users_debt(cls, transaction_ids: list[int], session: SessionData, optimal: bool = False):
+        return simplify(cls.get_users_balance(transaction_ids, session), optimal)
+
+# Members beyond this are settled greedily even when the optimal plan is requested, the search is exponential
+OPTIMAL_MAX_MEMBERS = 12
+
+
+def _to_cents(amount: Decimal) -> int:
+    return int((amount * 100).to_integral_value())
+
+
+def _settle_greedy(balance: list[tuple[int, int]]) -> list[tuple[int, int, int]]:
+    """
+    Settles (user_id, cents) balances that sum to zero by repeatedly matching the largest creditor with the largest debtor.
+
+    Returns (creditor_id, debtor_id, cents) transfers. Every step retires at least one member, so this is O(n log n).
+    """
+    creditors = [(-cents, user_id) for user_id, cents in balance if cents > 0]
+    debtors = [(cents, user_id) for user_id, cents in balance if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers: list[tuple[int, int, int]] = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((creditor_id, debtor_id, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+
+    return transfers
+
+
+def _zero_sum_groups(balance: list[tuple[int, int]]) -> list[list[tuple[int, int]]]:
+    """
+    Partitions non-zero (user_id, cents) balances into the largest number of groups that each sum to zero.
+
+    A group of k members settles in k - 1 transfers, so maximising the number of groups minimises the transfers.
+    """
+    size = len(balance)
+    full = (1 << size) - 1
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + balance[low.bit_length() - 1][1]
+
+        remaining = mask
+        most = 0
+        while remaining:
+            bit = remaining & -remaining
+            most = max(most, best[mask ^ bit])
+            remaining ^= bit
+        best[mask] = most + (sums[mask] == 0)
+
+    # Walk back from the full set to recover an order whose zero-sum prefixes are the group boundaries
+    order: list[int] = []
+    mask = full
+    while mask:
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            if best[mask ^ bit] + (sums[mask] == 0) == best[mask]:
+                break
+            remaining ^= bit
+        order.append(bit.bit_length() - 1)
+        mask ^= bit
+
+    groups: list[list[tuple[int, int]]] = []
+    current: list[tuple[int, int]] = []
+    prefix = 0
+    for index in reversed(order):
+        current.append(balance[index])
+        prefix |= 1 << index
+        if sums[prefix] == 0:
+            groups.append(current)
+            current = []
+
+    return groups
+
+
+def simplify(balance: list[Balance], optimal: bool = False) -> list[PayStructResponse]:
+    """
+    Builds a settlement plan that nets every member's balance to zero.
+
+    With optimal set, groups of up to OPTIMAL_MAX_MEMBERS are first split into zero-sum subsets,
+    which can cut the number of transfers below what the greedy matching produces.
+    """
+    cents = [(x.user_id, _to_cents(x.amount)) for x in balance]
+    if sum([x[1] for x in cents]) != 0:
         raise ValueError("Mismatched balance, cannot simplify")
 
-    while True:
-        balance = list(sorted(balance, key=lambda x: x.amount, reverse=True))
-        if len(balance) == 0:
-            break
-        debit = balance[0]
-        credit = balance[-1]
-
-        if debit.amount >= abs(credit.amount):
-            difference = debit.amount + credit.amount
-            pay_tree.append(PayStructResponse(debtor_id=debit.user_id, debtee_id=credit.user_id, amount=abs(credit.amount)))
-            balance.pop()
-            balance[0].amount = difference
-            if difference == Decimal(0):
-                balance.pop(0)
-        else:
-            difference = debit.amount + credit.amount
-            pay_tree.append(PayStructResponse(debtor_id=debit.user_id, debtee_id=credit.user_id, amount=debit.amount))
-            balance.pop(0)
-            balance[-1].amount = difference
-
-    return pay_tree
\ No newline at end of file
+    cents = [x for x in cents if x[1] != 0]
+    if optimal and len(cents) <= OPTIMAL_MAX_MEMBERS:
+        transfers = [transfer for group in _zero_sum_groups(cents) for transfer in _settle_greedy(group)]
+    else:
+        transfers = _settle_greedy(cents)
+
+    # The member being paid back is the debtor_id in PayStructResponse
+    return [
+        PayStructResponse(debtor_id=creditor_id, debtee_id=debtor_id, amount=Decimal(amount).scaleb(-2))
+        for creditor_id, debtor_id, amount in transfers
+    ]
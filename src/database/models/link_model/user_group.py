@@ -1,5 +1,26 @@
-from sqlmodel import Field, SQLModel
+from sqlmodel import Field, SQLModel, Session
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
 
 class UserGroupLink(SQLModel, table=True):
     group_id: int | None = Field(default=None, foreign_key="group.id", primary_key=True)
     user_id: int | None = Field(default=None, foreign_key="user.id", primary_key=True)
+
+    @classmethod
+    def link(cls, pairs: list[tuple[int, int]], conn: Session) -> list[tuple[int, int]]:
+        """Adds (group_id, user_id) memberships in one statement, returning those that did not exist yet. Does not commit."""
+        if not pairs:
+            return []
+        table = UserGroupLink.__table__  # type: ignore
+        stmt = insert(table).values([{"group_id": group_id, "user_id": user_id} for group_id, user_id in pairs])
+        stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.group_id, table.c.user_id])
+        return [tuple(x) for x in conn.execute(stmt.returning(table.c.group_id, table.c.user_id))]
+
+    @classmethod
+    def unlink(cls, pairs: list[tuple[int, int]], conn: Session) -> list[tuple[int, int]]:
+        """Removes (group_id, user_id) memberships in one statement, returning those that existed. Does not commit."""
+        if not pairs:
+            return []
+        table = UserGroupLink.__table__  # type: ignore
+        stmt = delete(table).where(tuple_(table.c.group_id, table.c.user_id).in_(pairs))
+        return [tuple(x) for x in conn.execute(stmt.returning(table.c.group_id, table.c.user_id))]
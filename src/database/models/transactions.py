@@ -1,16 +1,26 @@
-from sqlmodel import Field, SQLModel, Relationship, select, or_
+import io
+import json
+from itertools import groupby
+from dataclasses import dataclass, fields
+from decimal import Decimal
+from sqlmodel import Field, SQLModel, Relationship, Session, select, func
 from datetime import date
-from sqlalchemy import Column, Date, DateTime
+from sqlalchemy import Column, Date, DateTime, Index, text, tuple_, union_all, update
 from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
-from typing import TYPE_CHECKING, Any, Dict, List
-from .link_model import Journal
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List
+from .link_model import Journal, UserGroupLink
+from .link_model.journal import Balance
+from .link_model.balance import UserGroupBalance, BalanceSnapshot, apply_journal_deltas, settle_journal_deltas, journal_deltas
 from .types import Money, SessionData
-from ..errors import TransactionDoesNotExistError
+from .groups import Group
+from .idempotency import IdempotencyKey
+from ..errors import TransactionDoesNotExistError, GroupDoesNotExistError, InvalidBreakdownError
+import events
 
 if TYPE_CHECKING:
-    from .groups import Group
-    from api.model.request import TransactionPost
+    from api.model.request import Breakdown, TransactionPost
 
 
 class TransactionBase(SQLModel):
@@ -26,9 +36,35 @@ class TransactionBase(SQLModel):
     is_itemized: bool = Field(default=False)
 
 
+@dataclass(slots=True)
+class TransactionRow:
+    """Read model for list endpoints, built straight from column tuples instead of ORM objects"""
+    id: int
+    description: str
+    amount: Decimal
+    transaction_date: date
+    category: str
+    sub_category: str
+    notes: str | None
+    details: Dict[str, Any] | None
+    is_session: bool
+    is_session_closed: bool
+    is_itemized: bool
+    group_id: int
+    created_at: datetime
+    updated_at: datetime
+
+
 class Transaction(TransactionBase, table=True):
+    __table_args__ = (
+        # Group listings ordered by date, also serves every other lookup by group_id
+        Index("ix_transaction_group_id_transaction_date_id", "group_id", "transaction_date", "id"),
+        # Partial index for a group's open sessions, its predicate must match the queries below
+        Index("ix_transaction_group_id_open_session", "group_id", postgresql_where=text("is_session AND NOT is_session_closed")),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
-    group_id: int = Field(default=None, foreign_key="group.id", nullable=False, index=True)
+    group_id: int = Field(default=None, foreign_key="group.id", nullable=False)
     created_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), default=datetime.utcnow))
     updated_at: datetime = Field(default=None, sa_column=Column(DateTime(timezone=True), onupdate=datetime.utcnow, default=datetime.utcnow))
 
@@ -44,58 +80,360 @@ class Transaction(TransactionBase, table=True):
         return transaction
 
     @classmethod
-    def get_group_transactions(cls, group_id: int, session: SessionData):
-        return session.conn.exec(select(Transaction).where(Transaction.group_id == group_id)).all()
+    def _select_rows(cls):
+        """Selects the TransactionRow columns, in field order"""
+        return select(*[getattr(Transaction, x.name) for x in fields(TransactionRow)])
+
+    @classmethod
+    def _group_transactions_query(cls, group_id: int, since: date | None, until: date | None, after: tuple[date, int] | None):
+        """Newest first, keyed on (transaction_date, id) so pages can resume after the last row seen"""
+        query = cls._select_rows().where(Transaction.group_id == group_id)
+        if since:
+            query = query.where(Transaction.transaction_date >= since)
+        if until:
+            query = query.where(Transaction.transaction_date <= until)
+        if after:
+            query = query.where(tuple_(Transaction.transaction_date, Transaction.id) < tuple_(*after))
+
+        return query.order_by(Transaction.transaction_date.desc(), Transaction.id.desc())  # type: ignore
+
+    @classmethod
+    def get_group_transactions(
+        cls,
+        group_id: int,
+        session: SessionData,
+        since: date | None = None,
+        until: date | None = None,
+        after: tuple[date, int] | None = None,
+        limit: int | None = None,
+    ):
+        query = cls._group_transactions_query(group_id, since, until, after)
+        if limit:
+            query = query.limit(limit)
+        return [TransactionRow(*x) for x in session.conn.exec(query)]
+
+    @classmethod
+    def stream_group_transactions(
+        cls,
+        group_id: int,
+        session: SessionData,
+        since: date | None = None,
+        until: date | None = None,
+        batch_size: int = 500,
+    ) -> Iterator[TransactionRow]:
+        """Yields the group's transactions from a server side cursor, holding at most batch_size rows at a time"""
+        query = cls._group_transactions_query(group_id, since, until, None)
+        for row in session.conn.exec(query.execution_options(yield_per=batch_size)):
+            yield TransactionRow(*row)
 
     @classmethod
-    def get_closed_transactions(cls, group_id: int, session: SessionData):
-        transactions = session.conn.exec(select(Transaction).where(Transaction.group_id==group_id, Transaction.is_session==False)).all()
-        transactions = transactions + session.conn.exec(select(Transaction).where(Transaction.group_id==group_id, Transaction.is_session==True, Transaction.is_session_closed==True)).all()
-        return transactions
+    def get_group_balance(cls, group_id: int, session: SessionData) -> list[Balance]:
+        """Net balance per member over the group's closed transactions, read from the settled running balances"""
+        rows = session.conn.exec(
+            select(UserGroupBalance.user_id, UserGroupBalance.settled)
+            .where(UserGroupBalance.group_id == group_id, UserGroupBalance.settled != 0)
+        ).all()
+
+        return [Balance(user_id=user_id, amount=amount) for user_id, amount in rows]
+
+    @classmethod
+    def get_group_balance_history(cls, group_id: int, since: date, until: date, conn: Session) -> list[tuple[date, dict[int, Decimal]]]:
+        """
+        Net balance per member at the end of since, and at the end of every later day up to until on which it changed.
+
+        Starts from the nearest BalanceSnapshot before since, so only the journals dated after it are read.
+        """
+        snapshot = BalanceSnapshot.latest(group_id, since, conn)
+        balances = snapshot.amounts() if snapshot else {}
+
+        dated = [Transaction.group_id == group_id, Transaction.transaction_date <= until]
+        if snapshot:
+            dated.append(Transaction.transaction_date > snapshot.as_of)
+        signed = union_all(
+            select(Transaction.transaction_date, Journal.payer_id.label("user_id"), Journal.amount.label("amount"))
+                .join(Transaction, Journal.transaction_id == Transaction.id).where(*dated),
+            select(Transaction.transaction_date, Journal.payee_id.label("user_id"), (-Journal.amount).label("amount"))
+                .join(Transaction, Journal.transaction_id == Transaction.id).where(*dated),
+        ).subquery()
+        rows = conn.exec(
+            select(signed.c.transaction_date, signed.c.user_id, func.sum(signed.c.amount))
+            .group_by(signed.c.transaction_date, signed.c.user_id)
+            .order_by(signed.c.transaction_date)
+        )
+
+        series: list[tuple[date, dict[int, Decimal]]] = []
+        for day, changes in groupby(rows, key=lambda x: x[0]):
+            if day > since and not series:
+                series.append((since, dict(balances)))
+            for _, user_id, amount in changes:
+                balances[user_id] = balances.get(user_id, Decimal(0)) + amount
+            if day >= since:
+                series.append((day, dict(balances)))
+
+        if not series:
+            series.append((since, balances))
+        return series
+
+    @classmethod
+    def get_group_balance_as_of(cls, group_id: int, as_of: date, conn: Session) -> dict[int, Decimal]:
+        return cls.get_group_balance_history(group_id, as_of, as_of, conn)[-1][1]
 
     @classmethod
     def get_active_session(cls, session: "SessionData"):
-        groups = session.user.groups
-        groups_id = [x.id for x in groups]
-        trx_sessions = session.conn.exec(select(Transaction).where(Transaction.group_id.in_(groups_id), Transaction.is_session == True, Transaction.is_session_closed == False)).all() # type: ignore
+        groups_id = select(UserGroupLink.group_id).where(UserGroupLink.user_id == session.user_id)
+        trx_sessions = session.conn.exec(cls._select_rows().where(Transaction.group_id.in_(groups_id), Transaction.is_session == True, Transaction.is_session_closed == False)) # type: ignore
 
-        return trx_sessions
+        return [TransactionRow(*x) for x in trx_sessions]
+
+    @classmethod
+    def count_active_sessions(cls, session: SessionData) -> int:
+        groups_id = select(UserGroupLink.group_id).where(UserGroupLink.user_id == session.user_id)
+        return session.conn.exec(select(func.count()).select_from(Transaction).where(Transaction.group_id.in_(groups_id), Transaction.is_session == True, Transaction.is_session_closed == False)).one() # type: ignore
 
     @classmethod
     def get_group_sessions(cls, group_id: int, session: SessionData):
-        return session.conn.exec(select(Transaction).where(Transaction.group_id==group_id, Transaction.is_session==True, Transaction.is_session_closed==False)).all()
+        rows = session.conn.exec(cls._select_rows().where(Transaction.group_id==group_id, Transaction.is_session==True, Transaction.is_session_closed==False))
+        return [TransactionRow(*x) for x in rows]
+
+    @classmethod
+    def close_sessions(cls, group_id: int, transaction_ids: list[int] | None, session: SessionData) -> list[int]:
+        """
+        Closes open sessions of a group the user is a member of in one statement, all of them when transaction_ids is None.
+
+        Only the journals of the sessions closed here are read and folded into the settled balances, so the cost does
+        not grow with the group's history. Sessions that were already closed are skipped, returns the ids closed.
+        """
+        Group.check_member(group_id, session)
+
+        open_session = [Transaction.group_id == group_id, Transaction.is_session == True, Transaction.is_session_closed == False]
+        if transaction_ids is not None:
+            open_session.append(Transaction.id.in_(transaction_ids))  # type: ignore
+        closed_ids = list(session.conn.execute(
+            update(Transaction).where(*open_session).values(is_session_closed=True).returning(Transaction.id)
+        ).scalars().all())
+        if not closed_ids:
+            session.conn.rollback()
+            return []
+        # Every writer locks the group row before any balance row, so they cannot deadlock on each other
+        Group.bump_version([group_id], session.conn)
+
+        entries = session.conn.exec(select(Journal.payer_id, Journal.payee_id, Journal.amount).where(Journal.transaction_id.in_(closed_ids))).all()  # type: ignore
+        settle_journal_deltas(group_id, entries, session.conn)
+        session.conn.commit()
+
+        # Balances were already counted when the sessions were added, only every member's open session count moves
+        events.emit(events.TRANSACTIONS_CHANGED, group_ids=[group_id], user_ids=Group.get_member_ids(group_id, session.conn), balance_deltas={}, sessions_changed=True)
+        return sorted(closed_ids)
+
+    @classmethod
+    def create_transaction(cls, data: "TransactionPost", session: SessionData, idempotency_key: str | None = None) -> int:
+        """
+        Inserts the transaction and its journals.
+
+        Breakdowns of the same payer and payee are merged into one journal, and all journals go in with a single
+        multi-row insert. Raises InvalidBreakdownError on bad totals or outsiders, GroupDoesNotExistError if the
+        caller is not a member.
+
+        With an idempotency key, the key is stored in the same commit. Call IdempotencyKey.claim first so retries are serialized.
+        """
+        check_breakdowns(data)
+        entries = aggregate_breakdowns(data.breakdowns)
+        check_participants(data.group_id, session.user_id, {x[0] for x in entries} | {x[1] for x in entries}, session.conn)  # type: ignore
+
+        transaction_table = Transaction.__table__  # type: ignore
+        transaction_id = session.conn.execute(insert(transaction_table).values(
+            description=data.description,
+            amount=data.amount,
+            transaction_date=data.transaction_date,
+            category=data.category,
+            sub_category=data.sub_category,
+            notes=data.notes,
+            details=data.details,
+            is_session=data.is_session,
+            is_session_closed=data.is_session_closed,
+            is_itemized=data.is_itemized,
+            group_id=data.group_id,
+        ).returning(transaction_table.c.id)).scalar_one()
+        # Locks the group row before snapshots are dropped below, snapshot_balances takes the same lock
+        Group.bump_version([data.group_id], session.conn)
+
+        # A zero amount transaction has no breakdowns, and an empty multi-row insert would write one row of NULLs
+        if entries:
+            journal_table = Journal.__table__  # type: ignore
+            now = datetime.utcnow()
+            written = session.conn.execute(insert(journal_table).values([
+                {"transaction_id": transaction_id, "payer_id": payer, "payee_id": payee, "amount": amount, "item_detail": item_detail, "created_at": now, "updated_at": now}
+                for payer, payee, amount, item_detail in entries
+            ]).returning(journal_table.c.payer_id, journal_table.c.payee_id, journal_table.c.amount)).all()
+
+            apply_journal_deltas(data.group_id, [tuple(x) for x in written], session.conn, settled=not data.is_session or data.is_session_closed)
+            BalanceSnapshot.invalidate_from(data.group_id, data.transaction_date, session.conn)
+        if idempotency_key:
+            session.conn.add(IdempotencyKey(
+                user_id=session.user_id,
+                key=idempotency_key,
+                request_hash=IdempotencyKey.hash_request(data),
+                transaction_id=transaction_id,
+            ))
+        session.conn.commit()
+        _emit_changes([data], session.conn)
+
+        return transaction_id
 
     @classmethod
-    def create_transaction(cls, data: "TransactionPost", session: SessionData) -> int:
-        breakdown_total = sum([x.amount for x in data.breakdowns])
-        if data.amount != breakdown_total:
-            raise ValueError(f"Mismatch totals. Total amount should be {data.amount}. Breakdown amount is {breakdown_total}")
-
-        transaction = Transaction(description=data.description,
-                                amount=data.amount,
-                                transaction_date=data.transaction_date,
-                                category=data.category,
-                                sub_category=data.sub_category,
-                                notes=data.notes,
-                                details=data.details,
-                                is_session=data.is_session,
-                                is_session_closed=data.is_session_closed,
-                                is_itemized=data.is_itemized,
-                                group_id=data.group_id,
-                                )
-
-        transaction_details = []
-        for breakdown in data.breakdowns:
-            transaction_details.append(Journal(
-                transaction=transaction,
-                payer_id=breakdown.payer,
-                payee_id=breakdown.payee,
-                amount=breakdown.amount,
-                item_detail=breakdown.item_detail,
-                ))
-
-        session.conn.add(transaction)
+    def bulk_create(cls, rows: list["TransactionPost"], session: SessionData) -> list[int]:
+        """
+        Inserts many transactions and their journals in one database transaction, returning their ids in order.
+
+        Rows are streamed into temporary staging tables with COPY and moved across with set based inserts,
+        so the number of round trips does not depend on the number of rows. Rows must already be validated.
+        """
+        transactions = io.StringIO()
+        journals = io.StringIO()
+        # (group_id, settled) -> journal entries, as written to the journal table
+        by_group: dict[tuple[int, bool], list[tuple[int, int, Decimal]]] = {}
+        for ref, data in enumerate(rows):
+            transactions.write(_copy_row([
+                ref, data.description, data.amount, data.transaction_date, data.category, data.sub_category, data.notes,
+                json.dumps(data.details) if data.details is not None else None,
+                data.is_session, data.is_session_closed, data.is_itemized, data.group_id,
+            ]))
+            entries = by_group.setdefault((data.group_id, not data.is_session or data.is_session_closed), [])
+            for payer, payee, amount, item_detail in aggregate_breakdowns(data.breakdowns):
+                journals.write(_copy_row([ref, payer, payee, amount, json.dumps(item_detail)]))
+                entries.append((payer, payee, amount))
+        transactions.seek(0)
+        journals.seek(0)
+
+        conn = session.conn.connection()
+        conn.execute(text(
+            "CREATE TEMP TABLE staging_transaction ("
+            "ref integer PRIMARY KEY, id integer, description text, amount numeric, transaction_date date, category text, "
+            "sub_category text, notes text, details jsonb, is_session boolean, is_session_closed boolean, is_itemized boolean, "
+            "group_id integer) ON COMMIT DROP"
+        ))
+        conn.execute(text(
+            "CREATE TEMP TABLE staging_journal (ref integer, payer_id integer, payee_id integer, amount numeric, item_detail jsonb) ON COMMIT DROP"
+        ))
+
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(
+            "COPY staging_transaction (ref, description, amount, transaction_date, category, sub_category, notes, details, "
+            "is_session, is_session_closed, is_itemized, group_id) FROM STDIN",
+            transactions,
+        )
+        cursor.copy_expert("COPY staging_journal (ref, payer_id, payee_id, amount, item_detail) FROM STDIN", journals)
+
+        # Ids are drawn up front so journals can be joined to their transaction through ref
+        conn.execute(text("UPDATE staging_transaction SET id = nextval(pg_get_serial_sequence('transaction', 'id'))"))
+        conn.execute(text(
+            "INSERT INTO transaction (id, description, amount, transaction_date, category, sub_category, notes, details, "
+            "is_session, is_session_closed, is_itemized, group_id, created_at, updated_at) "
+            "SELECT id, description, amount, transaction_date, category, sub_category, notes, details, "
+            "is_session, is_session_closed, is_itemized, group_id, now(), now() FROM staging_transaction"
+        ))
+        conn.execute(text(
+            "INSERT INTO journal (transaction_id, payer_id, payee_id, amount, item_detail, created_at, updated_at) "
+            "SELECT t.id, j.payer_id, j.payee_id, j.amount, j.item_detail, now(), now() "
+            "FROM staging_journal j JOIN staging_transaction t ON t.ref = j.ref"
+        ))
+        ids = [x.id for x in conn.execute(text("SELECT id FROM staging_transaction ORDER BY ref"))]
+
+        # Group rows are locked before any balance row, in the same order as every other writer
+        Group.bump_version(list({group_id for group_id, _ in by_group}), session.conn)
+        for (group_id, settled), entries in sorted(by_group.items()):
+            apply_journal_deltas(group_id, entries, session.conn, settled)
+        earliest: dict[int, date] = {}
+        for data in rows:
+            earliest[data.group_id] = min(earliest.get(data.group_id, data.transaction_date), data.transaction_date)
+        for group_id, transaction_date in earliest.items():
+            BalanceSnapshot.invalidate_from(group_id, transaction_date, session.conn)
+
         session.conn.commit()
-        session.conn.refresh(transaction)
+        _emit_changes(rows, session.conn)
+        return ids
+
+
+def _emit_changes(rows: list["TransactionPost"], conn: Session):
+    """
+    Emits one TRANSACTIONS_CHANGED event per group for committed rows.
+
+    Affected users are the participants, and every member when an open session was added since their session count moved.
+    """
+    by_group: dict[int, list["TransactionPost"]] = {}
+    for data in rows:
+        by_group.setdefault(data.group_id, []).append(data)
+
+    for group_id, group_rows in by_group.items():
+        balance_deltas = journal_deltas((x.payer, x.payee, x.amount) for data in group_rows for x in data.breakdowns)
+        users = {x.payer for data in group_rows for x in data.breakdowns} | {x.payee for data in group_rows for x in data.breakdowns}
+        sessions_changed = any(x.is_session and not x.is_session_closed for x in group_rows)
+        if sessions_changed:
+            users.update(Group.get_member_ids(group_id, conn))
+
+        events.emit(
+            events.TRANSACTIONS_CHANGED,
+            group_ids=[group_id],
+            user_ids=list(users),
+            balance_deltas=balance_deltas,
+            sessions_changed=sessions_changed,
+        )
+
+
+def check_breakdowns(data: "TransactionPost"):
+    """Raises an InvalidBreakdownError unless the breakdowns add up to the amount"""
+    breakdown_total = sum((x.amount for x in data.breakdowns), Decimal(0))
+    if data.amount != breakdown_total:
+        raise InvalidBreakdownError(f"Mismatch totals. Total amount should be {data.amount}. Breakdown amount is {breakdown_total}")
+
+
+def aggregate_breakdowns(breakdowns: list["Breakdown"]) -> list[tuple[int, int, Decimal, dict[str, Any]]]:
+    """
+    Merges breakdowns into one (payer, payee, amount, item_detail) journal row per pair, the journal's primary key.
+
+    Itemized receipts name the same pair once per line item. Their amounts are summed and, when a pair has more
+    than one line, the item details are kept in order under "items".
+    """
+    merged: dict[tuple[int, int], tuple[Decimal, list[dict[str, Any]]]] = {}
+    for breakdown in breakdowns:
+        key = (breakdown.payer, breakdown.payee)
+        if key in merged:
+            amount, details = merged[key]
+            details.append(breakdown.item_detail)
+            merged[key] = (amount + breakdown.amount, details)
+        else:
+            merged[key] = (breakdown.amount, [breakdown.item_detail])
+
+    return [
+        (payer, payee, amount, details[0] if len(details) == 1 else {"items": details})
+        for (payer, payee), (amount, details) in merged.items()
+    ]
+
+
+def check_participants(group_id: int, user_id: int, participants: set[int], conn: Session):
+    """
+    Checks in one query that the caller and every payer and payee belong to the group.
+
+    Raises GroupDoesNotExistError when the caller is not a member, and InvalidBreakdownError naming any other outsider.
+    """
+    members = set(conn.exec(
+        select(UserGroupLink.user_id).where(UserGroupLink.group_id == group_id, UserGroupLink.user_id.in_(participants | {user_id}))  # type: ignore
+    ).all())
+    if user_id not in members:
+        raise GroupDoesNotExistError(f"Group with id {group_id} does not exist")
+    outsiders = sorted(participants - members)
+    if outsiders:
+        raise InvalidBreakdownError(f"User with id(s): {outsiders} are not members of group {group_id}")
+
+
+# Characters COPY text format reads as escapes or separators
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_row(values: list[Any]) -> str:
+    """
+    One line of COPY text format. None becomes \\N, and backslashes and line or field separators in values are
+    escaped, so a value that is literally \\N stays a string.
+    """
+    return "\t".join("\\N" if x is None else str(x).translate(_COPY_ESCAPES) for x in values) + "\n"
 
-        return transaction.id # type: ignore
\ No newline at end of file
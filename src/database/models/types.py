@@ -8,6 +8,15 @@ if TYPE_CHECKING:
 Money = condecimal(max_digits=10, decimal_places=2)
 
 class SessionData:
-    def __init__(self, user: "User", conn: Session):
-        self.user = user
+    def __init__(self, conn: Session, user_id: int | None = None, user: "User | None" = None):
         self.conn = conn
+        self.user_id: int = user_id if user_id is not None else user.id  # type: ignore
+        self._user = user
+
+    @property
+    def user(self) -> "User":
+        """The ORM user, only loaded from the database on first access"""
+        if self._user is None:
+            from .users import User
+            self._user = self.conn.get(User, self.user_id)
+        return self._user  # type: ignore
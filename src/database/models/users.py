@@ -1,3 +1,4 @@
+from pydantic import BaseModel
 from sqlmodel import Field, SQLModel, Relationship, Session, select
 from datetime import datetime
 from sqlalchemy import Column, DateTime, String
@@ -9,6 +10,12 @@ if TYPE_CHECKING:
     from .groups import Group
     from .transactions import Transaction
 
+class UserResponse(BaseModel):
+    id: int
+    name: str
+    push_on: bool
+    email_on: bool
+
 class UserBase(SQLModel):
     name: str
     email: str = Field(sa_column=Column(String, unique=True, nullable=False))
@@ -25,8 +32,9 @@ class User(UserBase, table=True):
 
     # Foreign Attributes
     groups: List["Group"] = Relationship(back_populates="users", link_model=UserGroupLink)
-    as_payer: List["Journal"] = Relationship(back_populates="payer", sa_relationship_kwargs={"primaryjoin": "Journal.payer_id==User.id", "lazy": "joined"})
-    as_payee: List["Journal"] = Relationship(back_populates="payee", sa_relationship_kwargs={"primaryjoin": "Journal.payee_id==User.id", "lazy": "joined"})
+    # A user's journals grow without bound, so they are never loaded implicitly. Queries that need them must ask with selectinload.
+    as_payer: List["Journal"] = Relationship(back_populates="payer", sa_relationship_kwargs={"primaryjoin": "Journal.payer_id==User.id", "lazy": "raise"})
+    as_payee: List["Journal"] = Relationship(back_populates="payee", sa_relationship_kwargs={"primaryjoin": "Journal.payee_id==User.id", "lazy": "raise"})
 
     @classmethod
     def get_by_id(cls, user_id: int, session: Session):
@@ -39,12 +47,21 @@ class User(UserBase, table=True):
     @classmethod
     def get_by_ids(cls, user_ids: list[int], session: Session):
         users = session.exec(select(User).where(User.id.in_(user_ids))).all() # type: ignore
-        missing_user = [x for x in user_ids if x not in [y.id for y in users]]
+        found = {x.id for x in users}
+        missing_user = [x for x in user_ids if x not in found]
         if missing_user:
             raise UserDoesNotExistError(f"User with id(s): {missing_user} does not exist")
 
         return users
 
+    @classmethod
+    def check_ids(cls, user_ids: list[int], session: Session):
+        """Raises UserDoesNotExistError unless every id is a user, reading only the ids"""
+        found = set(session.exec(select(User.id).where(User.id.in_(user_ids))).all())  # type: ignore
+        missing_user = sorted(set(user_ids) - found)
+        if missing_user:
+            raise UserDoesNotExistError(f"User with id(s): {missing_user} does not exist")
+
     @classmethod
     def get_by_username(cls, username: str, session: Session):
         user = session.exec(select(User).where(User.username == username)).first()
@@ -0,0 +1,54 @@
+"""
+Routes read-only handlers to the replica engine, with read-your-writes stickiness.
+
+Every commit of a session tagged with a user marks that user in the cache for replica_sticky_seconds, and
+read sessions for a marked user stay on the primary. With the default in-process cache the mark is per
+worker, point cache_url at Redis to share it between workers.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.dml import UpdateBase
+from sqlmodel import Session
+from cache import get_cache, recent_write_key
+from settings import get_settings
+from . import get_engine, get_replica_engine
+
+
+class RoutingSession(Session):
+    """Session for read-only handlers. Queries go to the replica, anything that writes or flushes to the primary."""
+    def __init__(self, primary: Engine, replica: Engine, **kwargs):
+        super().__init__(bind=primary, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            return super().get_bind(mapper, clause, **kwargs)
+        return self.replica
+
+
+def mark_recent_write(user_id: int):
+    get_cache().backend.set(recent_write_key(user_id), "1", get_settings().replica_sticky_seconds)
+
+
+def has_recent_write(user_id: int) -> bool:
+    return get_cache().backend.get(recent_write_key(user_id)) is not None
+
+
+@event.listens_for(Session, "after_commit")
+def _record_write(session: Session):
+    user_id = session.info.get("user_id")
+    if user_id is not None:
+        mark_recent_write(user_id)
+
+
+def read_session(user_id: int) -> Session:
+    """A session for the user's read-only request, on the primary when there is no replica or the user just wrote"""
+    replica = get_replica_engine()
+    if replica is None or has_recent_write(user_id):
+        return Session(get_engine())
+    return RoutingSession(get_engine(), replica)
+
+
+def cache_ttl(conn: Session) -> float | None:
+    """TTL for cache entries computed from conn. Replica reads may lag, so their entries only live for the sticky window."""
+    return get_settings().replica_sticky_seconds if isinstance(conn, RoutingSession) else None
@@ -0,0 +1,35 @@
+"""
+In-process bus for change events emitted by the write paths once their transaction has committed.
+
+Derived data (caches, subscriptions) registers listeners here instead of being called from every write path.
+"""
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# group_ids: groups whose transactions changed, user_ids: users whose balance or session count may have changed,
+# balance_deltas: user_id -> change in net balance, sessions_changed: whether open sessions were added or closed
+TRANSACTIONS_CHANGED = "transactions_changed"
+# group_ids: groups that gained or lost members, user_ids: the members that joined or left
+MEMBERSHIP_CHANGED = "membership_changed"
+
+Listener = Callable[..., None]
+
+_listeners: dict[str, list[Listener]] = {}
+_lock = threading.Lock()
+
+
+def subscribe(event: str, listener: Listener):
+    with _lock:
+        _listeners.setdefault(event, []).append(listener)
+
+
+def emit(event: str, *, group_ids: list[int], user_ids: list[int], **payload):
+    """Calls every listener of the event. A failing listener is logged and does not stop the others or the caller."""
+    for listener in list(_listeners.get(event, [])):
+        try:
+            listener(event, group_ids=group_ids, user_ids=user_ids, **payload)
+        except Exception:
+            logger.exception("Listener %r failed on %s", listener, event)
@@ -0,0 +1,182 @@
+"""
+Per route latency, SQL statement counts, database time and rows fetched.
+
+A middleware opens a RequestStats for each request and SQLAlchemy cursor events on every Engine add to it.
+Totals are kept in a small in-process registry rendered in the Prometheus text format by /metrics, and each
+response gets a Server-Timing header with its own numbers. A request running the same statement many times
+is logged as a likely N+1 pattern.
+
+Streamed responses (NDJSON exports, SSE) are recorded when their body ends, so statements run while streaming
+count towards their route. Their latency and Server-Timing header still only cover the work up to the response start.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        # statement text -> executions. Parameters are bound separately, so the text is the statement shape.
+        self.shapes: Counter[str] = Counter()
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "handle_error")
+def _on_error(context):
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    stats.rows += max(cursor.rowcount, 0)
+    stats.shapes[statement] += 1
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Thread safe metric totals labelled by (method, route)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.responses: Counter[tuple[str, str, int]] = Counter()
+        self.statements: Counter[tuple[str, str]] = Counter()
+        self.db_seconds: Counter[tuple[str, str]] = Counter()
+        self.rows: Counter[tuple[str, str]] = Counter()
+        self.n_plus_one: Counter[tuple[str, str]] = Counter()
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats, n_plus_one: bool):
+        key = (method, route)
+        with self._lock:
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.responses[(method, route, status)] += 1
+            self.statements[key] += stats.statements
+            self.db_seconds[key] += stats.db_seconds
+            self.rows[key] += stats.rows
+            if n_plus_one:
+                self.n_plus_one[key] += 1
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+
+        def counter(name: str, help: str, values: Counter):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} counter")
+            for (method, route), value in sorted(values.items()):
+                lines.append(f'{name}{{method="{method}",route="{route}"}} {value}')
+
+        with self._lock:
+            lines.append("# HELP http_request_duration_seconds Handler latency, including the response start")
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for (method, route), histogram in sorted(self.latency.items()):
+                labels = f'method="{method}",route="{route}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                cumulative += histogram.counts[-1]
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+            lines.append("# HELP http_responses_total Responses by status code")
+            lines.append("# TYPE http_responses_total counter")
+            for (method, route, status), value in sorted(self.responses.items()):
+                lines.append(f'http_responses_total{{method="{method}",route="{route}",status="{status}"}} {value}')
+
+            counter("db_statements_total", "SQL statements executed", self.statements)
+            counter("db_seconds_total", "Time spent executing SQL statements", self.db_seconds)
+            counter("db_rows_total", "Rows returned or affected by SQL statements", self.rows)
+            counter("db_n_plus_one_requests_total", "Requests that repeated one statement n_plus_one_threshold times or more", self.n_plus_one)
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _route(request: Request) -> str:
+    """The route template, so /group/1/users and /group/2/users share their metrics"""
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def _record(request: Request, route: str, status: int, elapsed: float, stats: RequestStats):
+    threshold = get_settings().n_plus_one_threshold
+    repeated = stats.repeated(threshold)
+    for shape, count in repeated:
+        logger.warning("Possible N+1 on %s %s: statement ran %d times\n%s", request.method, route, count, shape)
+
+    registry.record(request.method, route, status, elapsed, stats, bool(repeated))
+
+
+async def instrument_request(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """HTTP middleware, register with app.middleware("http")"""
+    stats = RequestStats()
+    token = _current.set(stats)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    elapsed = time.perf_counter() - start
+
+    route = _route(request)
+    response.headers["Server-Timing"] = (
+        f'app;dur={elapsed * 1000:.1f}, db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} queries, {stats.rows} rows"'
+    )
+
+    # The handler's task keeps adding to stats while the body is produced, record once it is fully sent
+    body = response.body_iterator  # type: ignore
+
+    async def recorded_body() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            _record(request, route, response.status_code, elapsed, stats)
+
+    response.body_iterator = recorded_body()  # type: ignore
+    return response
@@ -1,17 +1,45 @@
-from fastapi import FastAPI, Depends, status, Security, Form, Response
+from datetime import date
+from fastapi import FastAPI, Depends, status, Security, Form, Response, Query, Request, Header, HTTPException, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import  OAuth2PasswordRequestForm
 from api.model.response import *
 from api.model.request import *
-from database import Transaction, Group, Journal
+from sqlmodel import Session
+from database import Transaction, Group, init_engine, dispose_engine, get_engine, pool_status
 from database.models.types import SessionData
+from database.models.idempotency import IdempotencyKey
+from database.errors import IdempotencyKeyReusedError, GroupDoesNotExistError, UserDoesNotExistError, InvalidBreakdownError
+from storage import get_blob_store, iter_file, content_type, read_limited, BlobTooLargeError, ORIGINAL, THUMBNAIL
+from settings import get_settings
+from cache import get_cache
+from subscriptions import get_broker, event_stream
+from instrumentation import instrument_request, registry
+from warmup import warm_up
 import api.authentication as auth
+from api.settlement import get_group_settlement
+from api.overview import get_overview
+from api.pagination import encode_cursor, decode_cursor
+from api.bulk_import import read_body, parse_csv, parse_ndjson, import_transactions
 
 app = FastAPI()
+app.middleware("http")(instrument_request)
+
+@app.on_event("startup")
+def startup():
+    settings = get_settings()
+    init_engine(settings)
+    if settings.warmup_enabled:
+        warm_up(settings.database_pool_size)
+
+@app.on_event("shutdown")
+def shutdown():
+    dispose_engine()
 
 @app.post("/token", response_model=auth.Token, tags=["authentication"])
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = auth.authenticate_user(form_data.username, form_data.password)
-    token_data = auth.TokenData(username=user.username)
+    user = await auth.authenticate_user(form_data.username, form_data.password)
+    token_data = auth.TokenData(user_id=user.id, username=user.username)
     return auth.Token(access_token=token_data.to_jwt())
 
 @app.post("/signup", tags=["authentication"])
@@ -19,64 +47,275 @@ async def signup(
     name: str = Form(...),
     username: str = Form(...),
     email: str = Form(...),
-    password: str = Form(...)
+    password: str = Form(...),
     ):
-    auth.create_new_user(name, username, email, password)
+    await auth.create_new_user(name, username, email, password)
 
     return Response(status_code=status.HTTP_201_CREATED)
 
 
 
 @app.post("/transaction", tags=["transaction"], response_model=IDResponse)
-async def create_transaction(transaction: TransactionPost, session: SessionData = Security(auth.session_data)):
-    transaction_id = Transaction.create_transaction(transaction, session)
+def create_transaction(
+    transaction: TransactionPost,
+    idempotency_key: str | None = Header(None, max_length=255),
+    session: SessionData = Security(auth.session_data),
+    ):
+    """Retries carrying the same Idempotency-Key header get the id of the first request instead of a duplicate"""
+    if idempotency_key:
+        try:
+            replayed_id = IdempotencyKey.claim(session.user_id, idempotency_key, transaction, session.conn)
+        except IdempotencyKeyReusedError as e:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+        if replayed_id is not None:
+            return IDResponse(id=replayed_id)
+
+    try:
+        transaction_id = Transaction.create_transaction(transaction, session, idempotency_key)
+    except InvalidBreakdownError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     return IDResponse(id=transaction_id)
 
+@app.post("/transaction/bulk", tags=["transaction"], response_model=BulkImportResponse)
+async def bulk_import_transactions(request: Request, session: SessionData = Security(auth.session_data)):
+    """
+    Imports many transactions at once, reporting the outcome of every row.
+
+    Send NDJSON of TransactionPost objects, or text/csv with one breakdown per line where lines sharing a ref form one transaction.
+    Bodies over max_import_bytes get a 413.
+    """
+    body = await read_body(request, get_settings().max_import_bytes)
+    parse = parse_csv if request.headers.get("content-type", "").startswith("text/csv") else parse_ndjson
+    return await run_in_threadpool(lambda: import_transactions(parse(body), session))
+
 @app.get("/transaction", response_model=Transaction, tags=["transaction"])
-async def get_transaction(transaction_id: int, session: SessionData = Security(auth.session_data)):
+def get_transaction(transaction_id: int, session: SessionData = Security(auth.session_data)):
     return Transaction.get_by_id(transaction_id, session)
 
 @app.get("/transaction/group_transactions", response_model=list[Transaction], tags=["transaction"])
-async def get_group_transactions(group_id: int, session: SessionData = Security(auth.session_data)):
-    return Transaction.get_group_transactions(group_id, session)
+def get_group_transactions(
+    group_id: int,
+    since: date | None = None,
+    until: date | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    session: SessionData = Security(auth.read_session_data),
+    ):
+    """Newest first. When more rows remain, the X-Next-Cursor header holds the cursor for the next page."""
+    after = decode_cursor(cursor) if cursor else None
+    transactions = Transaction.get_group_transactions(group_id, session, since, until, after, limit + 1)
+    headers = {}
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(transactions[-1].transaction_date, transactions[-1].id)
+    return FastJSONResponse(transactions, headers=headers)
+
+@app.get("/transaction/group_transactions/stream", tags=["transaction"])
+def stream_group_transactions(
+    group_id: int,
+    since: date | None = None,
+    until: date | None = None,
+    session: SessionData = Security(auth.read_session_data),
+    ):
+    """All of the group's transactions, newest first, as newline delimited JSON"""
+    rows = Transaction.stream_group_transactions(group_id, session, since, until)
+    return StreamingResponse((encode_json(x) + b"\n" for x in rows), media_type="application/x-ndjson")
 
 @app.get("/transaction/group_sessions", response_model=list[Transaction], tags=["transaction"])
-async def get_group_sessions(group_id: int, session: SessionData = Security(auth.session_data)):
-    return Transaction.get_group_sessions(group_id, session)
+def get_group_sessions(group_id: int, session: SessionData = Security(auth.read_session_data)):
+    return FastJSONResponse(Transaction.get_group_sessions(group_id, session))
 
 @app.get("/transaction/simplify_debt", response_model=list[PayStructResponse], tags=["transaction"])
-async def simplify_debts(session: SessionData = Security(auth.session_data)):
-    transactions = Transaction.get_closed_transactions(1, session)
-    return Journal.get_users_debt([x.id for x in transactions], session) # type: ignore
+def simplify_debts(group_id: int, optimal: bool = False, session: SessionData = Security(auth.read_session_data)):
+    return get_group_settlement(group_id, session, optimal)
 
 
 
 @app.post("/group/create", tags=["group"], response_model=IDResponse)
-async def create_group(data: GroupPost, session: SessionData = Security(auth.session_data)):
+def create_group(data: GroupPost, session: SessionData = Security(auth.session_data)):
+    if data.image and len(data.image) > get_settings().max_image_bytes:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Image is larger than {get_settings().max_image_bytes} bytes")
     group_id = Group.create_group(data, session)
     return IDResponse(id=group_id)
 
 @app.post("/group/{group_id}/adduser", tags=["group"])
-async def add_user_to_group(group_id: int, session: SessionData = Security(auth.session_data)):
-    group = Group.get_by_id(group_id, session)
-    session.user.groups.append(group)
-    session.conn.commit()
+def add_user_to_group(group_id: int, session: SessionData = Security(auth.session_data)):
+    try:
+        Group.join(session.user_id, [group_id], session.conn)  # type: ignore
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     return Response(status_code=status.HTTP_200_OK)
 
+@app.post("/group/{group_id}/members", response_model=MembershipResponse, tags=["group"])
+def add_group_members(group_id: int, data: MembersPost, session: SessionData = Security(auth.session_data)):
+    """Adds many users to a group the caller is a member of"""
+    try:
+        Group.check_member(group_id, session)
+        added = Group.add_members(group_id, data.user_ids, session.conn)
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except UserDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return MembershipResponse(group_ids=[group_id] if added else [], user_ids=added)
+
+@app.post("/group/{group_id}/members/remove", response_model=MembershipResponse, tags=["group"])
+def remove_group_members(group_id: int, data: MembersPost, session: SessionData = Security(auth.session_data)):
+    """Removes many users from a group the caller is a member of"""
+    try:
+        Group.check_member(group_id, session)
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    removed = Group.remove_members(group_id, data.user_ids, session.conn)
+    return MembershipResponse(group_ids=[group_id] if removed else [], user_ids=removed)
+
+@app.get("/group/{group_id}/settlement", response_model=list[PayStructResponse], tags=["group"])
+def get_group_settlement_plan(group_id: int, optimal: bool = False, session: SessionData = Security(auth.read_session_data)):
+    return get_group_settlement(group_id, session, optimal)
+
+@app.post("/group/{group_id}/sessions/close", response_model=SessionCloseResponse, tags=["group"])
+def close_group_sessions(group_id: int, data: SessionClosePost, optimal: bool = False, session: SessionData = Security(auth.session_data)):
+    """Closes the given open sessions, or all of them, and returns the settlement plan that now includes them"""
+    try:
+        closed = Transaction.close_sessions(group_id, data.transaction_ids, session)
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return SessionCloseResponse(closed=closed, settlement=get_group_settlement(group_id, session, optimal))
+
+@app.get("/group/{group_id}/balance_history", response_model=list[BalancePoint], tags=["group"])
+def get_group_balance_history(
+    group_id: int,
+    since: date,
+    until: date | None = None,
+    session: SessionData = Security(auth.read_session_data),
+    ):
+    """Member balances at the end of since and of every later day they changed, for charting. until defaults to today."""
+    until = until or date.today()
+    if until < since:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="until must not be before since")
+    try:
+        Group.check_member(group_id, session)
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    history = Transaction.get_group_balance_history(group_id, since, until, session.conn)
+    return [BalancePoint(date=day, balances=balances) for day, balances in history]
+
+@app.get("/group/{group_id}/image", tags=["group"])
+def get_group_image(
+    group_id: int,
+    variant: str = Query(THUMBNAIL, regex=f"^({ORIGINAL}|{THUMBNAIL})$"),
+    if_none_match: str | None = Header(None),
+    session: SessionData = Security(auth.session_data),
+    ):
+    """Streams the group image. Images are immutable per digest, so a matching If-None-Match gets a 304."""
+    try:
+        digest = Group.get_image_hash(group_id, session)
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    if digest is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Group with id {group_id} has no image")
+
+    etag = f'"{digest}-{variant}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if if_none_match and etag in [x.strip() for x in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        file = get_blob_store().open(digest, variant)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Group with id {group_id} has no image")
+    headers["X-Content-Type-Options"] = "nosniff"
+    return StreamingResponse(iter_file(file), media_type=content_type(file), headers=headers)
+
+@app.put("/group/{group_id}/image", tags=["group"])
+def set_group_image(group_id: int, image: UploadFile = File(...), session: SessionData = Security(auth.session_data)):
+    """Replaces the group image, uploads over max_image_bytes get a 413"""
+    try:
+        data = read_limited(image.file, get_settings().max_image_bytes)
+    except BlobTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    try:
+        Group.set_image(group_id, data, session)
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 @app.get("/group/{group_id}/users", response_model=list[UserResponse], tags=["group"])
-async def get_users(group_id: int, session: SessionData = Security(auth.session_data)):
+def get_users(group_id: int, session: SessionData = Security(auth.read_session_data)):
     return Group.get_users(group_id, session)
 
 
 
 
 @app.get("/user/overview", response_model=Overview, tags=["user"])
-async def get_user_overview(session: SessionData = Security(auth.session_data)):
-    balance = Journal.get_user_balance(session)
-    num_sessions = len(Transaction.get_active_session(session))
-
-    return Overview(balance=balance, sessions=num_sessions)
+def get_user_overview(session: SessionData = Security(auth.read_session_data)):
+    return get_overview(session)
 
 @app.get("/user/active_sessions", response_model=list[Transaction], tags=["user"])
-async def get_user_active_sessions(session: SessionData = Security(auth.session_data)):
-    return Transaction.get_active_session(session)
\ No newline at end of file
+def get_user_active_sessions(session: SessionData = Security(auth.read_session_data)):
+    return FastJSONResponse(Transaction.get_active_session(session))
+
+
+
+@app.post("/user/groups", response_model=MembershipResponse, tags=["user"])
+def join_groups(data: GroupsPost, session: SessionData = Security(auth.session_data)):
+    """Adds the caller to many groups at once"""
+    try:
+        joined = Group.join(session.user_id, data.group_ids, session.conn)  # type: ignore
+    except GroupDoesNotExistError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return MembershipResponse(group_ids=joined, user_ids=[session.user_id] if joined else [])
+
+@app.post("/user/groups/remove", response_model=MembershipResponse, tags=["user"])
+def leave_groups(data: GroupsPost, session: SessionData = Security(auth.session_data)):
+    """Removes the caller from many groups at once"""
+    left = Group.leave(session.user_id, data.group_ids, session.conn)  # type: ignore
+    return MembershipResponse(group_ids=left, user_ids=[session.user_id] if left else [])
+
+@app.get("/user/subscribe", tags=["user"])
+async def subscribe(group_id: int | None = None, token: str = Depends(auth.OAUTH2_SCHEME)):
+    """
+    Server-Sent Events stream of the user's balance and session changes, optionally limited to one group.
+
+    Replaces polling /user/overview and /user/active_sessions: apply balance_delta to the overview, and reload
+    the sessions when sessions_changed is set.
+    """
+    user_id = await run_in_threadpool(auth.authenticate_token, token)
+    if group_id is not None:
+        def check_member():
+            with Session(get_engine()) as conn:
+                Group.check_member(group_id, SessionData(conn=conn, user_id=user_id))
+        try:
+            await run_in_threadpool(check_member)
+        except GroupDoesNotExistError as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    return StreamingResponse(
+        event_stream(get_broker(), user_id, group_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+
+@app.get("/internal/pool", include_in_schema=False, dependencies=[Depends(auth.internal_access)])
+def get_pool_status():
+    """Connection pool metrics"""
+    return pool_status()
+
+@app.get("/internal/cache", include_in_schema=False, dependencies=[Depends(auth.internal_access)])
+def get_cache_stats():
+    """Cache hit and miss counts per view"""
+    return get_cache().stats()
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(auth.internal_access)])
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/internal/subscriptions", include_in_schema=False, dependencies=[Depends(auth.internal_access)])
+def get_subscription_stats():
+    """Open push connections in this worker"""
+    return {"connections": get_broker().connections()}
@@ -0,0 +1,116 @@
+import hashlib
+import io
+import os
+import tempfile
+from functools import lru_cache
+from typing import BinaryIO, Iterator
+from settings import get_settings
+
+ORIGINAL = "original"
+THUMBNAIL = "thumbnail"
+VARIANTS = (ORIGINAL, THUMBNAIL)
+
+# Leading bytes of the image formats clients upload, anything else is served as application/octet-stream
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+class BlobTooLargeError(ValueError):
+    pass
+
+
+def content_type(file: BinaryIO) -> str:
+    """Media type of a stored image, from its leading bytes. Leaves the file at its start."""
+    head = file.read(16)
+    file.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, media_type in SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return "application/octet-stream"
+
+
+def read_limited(file: BinaryIO, max_bytes: int, chunk_size: int = 64 * 1024) -> bytes:
+    """Reads an upload in chunks, raising BlobTooLargeError as soon as it goes past max_bytes"""
+    chunks = []
+    size = 0
+    while chunk := file.read(chunk_size):
+        size += len(chunk)
+        if size > max_bytes:
+            raise BlobTooLargeError(f"Image is larger than {max_bytes} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def make_thumbnail(data: bytes, size: int) -> bytes:
+    """
+    Downscales an image to fit in size x size pixels.
+
+    Pillow is optional, without it (or for data it cannot decode) the original bytes are used as the thumbnail.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            output = io.BytesIO()
+            image.save(output, format=image.format or "PNG")
+            return output.getvalue()
+    except Exception:
+        return data
+
+
+class LocalBlobStore:
+    """
+    Content addressed blob store on the local filesystem.
+
+    Blobs are named by the sha256 of their content, so storing the same image twice keeps a single copy.
+    The thumbnail is generated once, when the blob is first stored.
+    """
+    def __init__(self, root: str, thumbnail_size: int):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+
+    def _path(self, digest: str, variant: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{variant}")
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+    def put(self, data: bytes) -> str:
+        """Stores the blob and its thumbnail if not already present, returning its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self._path(digest, THUMBNAIL)):
+            self._write(self._path(digest, ORIGINAL), data)
+            self._write(self._path(digest, THUMBNAIL), make_thumbnail(data, self.thumbnail_size))
+        return digest
+
+    def open(self, digest: str, variant: str = ORIGINAL) -> BinaryIO:
+        """Raises FileNotFoundError if the blob is not stored"""
+        return open(self._path(digest, variant), "rb")
+
+
+def iter_file(file: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Reads the file in chunks for streaming, closing it at the end"""
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+@lru_cache()
+def get_blob_store() -> LocalBlobStore:
+    settings = get_settings()
+    return LocalBlobStore(settings.blob_store_root, settings.thumbnail_size)
@@ -0,0 +1,126 @@
+"""
+Pushes balance and session changes to connected clients, fed by the change events in events.py.
+
+Each subscriber accumulates the changes it has not been sent yet, so a burst of writes reaches the client as one
+coalesced delta. The broker lives in the worker process: a client only hears about writes served by the same worker.
+"""
+import asyncio
+import json
+import threading
+from decimal import Decimal
+from functools import lru_cache
+from typing import AsyncIterator
+import events
+from settings import get_settings
+
+
+class Subscriber:
+    """One connected client of a user, optionally limited to a single group"""
+    def __init__(self, user_id: int, group_id: int | None, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.group_id = group_id
+        self._loop = loop
+        self._pending = asyncio.Event()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.group_ids: set[int] = set()
+        self.balance_delta = Decimal(0)
+        self.sessions_changed = False
+        self.membership_changed = False
+
+    def push(self, group_ids: set[int], balance_delta: Decimal, sessions_changed: bool, membership_changed: bool):
+        """Records a change, safe to call from any thread"""
+        with self._lock:
+            self.group_ids |= group_ids
+            self.balance_delta += balance_delta
+            self.sessions_changed |= sessions_changed
+            self.membership_changed |= membership_changed
+        self._loop.call_soon_threadsafe(self._pending.set)
+
+    async def wait(self, timeout: float) -> bool:
+        """Waits for a change, returning False if none arrived within timeout seconds"""
+        try:
+            await asyncio.wait_for(self._pending.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def drain(self) -> dict:
+        """Returns and clears the changes accumulated since the last drain"""
+        with self._lock:
+            self._pending.clear()
+            delta = {
+                "group_ids": sorted(self.group_ids),
+                "balance_delta": str(self.balance_delta),
+                "sessions_changed": self.sessions_changed,
+                "membership_changed": self.membership_changed,
+            }
+            self._reset()
+        return delta
+
+
+class Broker:
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int, group_id: int | None = None) -> Subscriber:
+        """Registers a subscriber on the running event loop"""
+        subscriber = Subscriber(user_id, group_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.user_id, None)
+
+    def connections(self) -> int:
+        with self._lock:
+            return sum(len(x) for x in self._subscribers.values())
+
+    def publish(self, event: str, *, group_ids: list[int], user_ids: list[int], balance_deltas: dict[int, Decimal] | None = None, sessions_changed: bool = False, **payload):
+        """Hands a change event to the subscribers of the affected users, runs on the thread that committed the write"""
+        with self._lock:
+            targets = [(user_id, list(self._subscribers.get(user_id, ()))) for user_id in user_ids]
+
+        for user_id, subscribers in targets:
+            balance_delta = (balance_deltas or {}).get(user_id, Decimal(0))
+            for subscriber in subscribers:
+                matched = set(group_ids) if subscriber.group_id is None else set(group_ids) & {subscriber.group_id}
+                if matched:
+                    subscriber.push(matched, balance_delta, sessions_changed, event == events.MEMBERSHIP_CHANGED)
+
+
+async def event_stream(broker: Broker, user_id: int, group_id: int | None = None) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for one client.
+
+    Starts with a ready event, after which the client should load its views once. Every change event carries the
+    deltas accumulated over push_coalesce_seconds, and a comment is sent when idle to keep proxies from closing the stream.
+    """
+    settings = get_settings()
+    subscriber = broker.subscribe(user_id, group_id)
+    try:
+        yield "event: ready\ndata: {}\n\n"
+        while True:
+            if not await subscriber.wait(settings.push_keepalive_seconds):
+                yield ": keepalive\n\n"
+                continue
+            await asyncio.sleep(settings.push_coalesce_seconds)
+            yield f"event: change\ndata: {json.dumps(subscriber.drain())}\n\n"
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+@lru_cache()
+def get_broker() -> Broker:
+    broker = Broker()
+    events.subscribe(events.TRANSACTIONS_CHANGED, broker.publish)
+    events.subscribe(events.MEMBERSHIP_CHANGED, broker.publish)
+    return broker
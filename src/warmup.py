@@ -0,0 +1,68 @@
+"""
+Work a fresh worker would otherwise do on its first requests, run from the startup hook before it accepts traffic.
+
+Opens the pool's connections, runs the hot read queries once against ids that do not exist so SQLAlchemy's
+compiled statement cache is filled, and loads the bcrypt backend. Nothing here may fail startup.
+"""
+import logging
+import time
+from sqlmodel import Session
+from database import get_engine, get_replica_engine, Transaction, Group, Journal
+from database.models.types import SessionData
+import api.authentication as auth
+
+logger = logging.getLogger(__name__)
+
+# Ids no row has, the queries compile and run without reading data
+MISSING_ID = 0
+
+
+def prime_pool(connections: int):
+    """Opens connections to the primary, and the replica if there is one, instead of on the first concurrent requests"""
+    opened = []
+    try:
+        for engine in filter(None, (get_engine(), get_replica_engine())):
+            for _ in range(connections):
+                opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+def prime_queries():
+    queries = {
+        "principal": lambda s: auth.get_principal(MISSING_ID, s.conn),
+        "user_balance": lambda s: Journal.get_user_balance(s),
+        "active_sessions": lambda s: Transaction.get_active_session(s),
+        "count_active_sessions": lambda s: Transaction.count_active_sessions(s),
+        "group_transactions": lambda s: Transaction.get_group_transactions(MISSING_ID, s),
+        "group_sessions": lambda s: Transaction.get_group_sessions(MISSING_ID, s),
+        "group_balance": lambda s: Transaction.get_group_balance(MISSING_ID, s),
+        "group_users": lambda s: Group.get_users(MISSING_ID, s),
+    }
+    # Each engine keeps its own compiled statement cache
+    for engine in filter(None, (get_engine(), get_replica_engine())):
+        with Session(engine) as conn:
+            session = SessionData(conn=conn, user_id=MISSING_ID)
+            for name, query in queries.items():
+                try:
+                    query(session)
+                except Exception as e:
+                    # Missing ids raise the usual does-not-exist errors, only after the query ran
+                    logger.debug("Warm-up query %s raised %r", name, e)
+            conn.rollback()
+
+
+def prime_crypto():
+    """Picks the bcrypt backend, which passlib otherwise does on the first login"""
+    auth.pwd_context().handler("bcrypt").get_backend()
+
+
+def warm_up(connections: int):
+    start = time.perf_counter()
+    for step, args in ((prime_pool, (connections,)), (prime_queries, ()), (prime_crypto, ())):
+        try:
+            step(*args)
+        except Exception:
+            logger.exception("Warm-up step %s failed", step.__name__)
+    logger.info("Warm-up took %.0f ms", (time.perf_counter() - start) * 1000)
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from database import User, get_engine
+from tests.conftest import PASSWORD
+
+
+def test_signup_and_login(client):
+    form = {"name": "New", "username": "new_user", "email": "new@example.com", "password": PASSWORD}
+    assert client.post("/signup", data=form).status_code == 201
+    assert client.post("/signup", data=form).status_code == 400
+
+    response = client.post("/token", data={"username": "new_user", "password": PASSWORD})
+    assert response.status_code == 200
+    assert client.get("/user/overview", headers={"Authorization": f"Bearer {response.json()['access_token']}"}).status_code == 200
+    assert client.post("/token", data={"username": "new_user", "password": "wrong"}).status_code == 401
+    assert client.post("/token", data={"username": "missing", "password": PASSWORD}).status_code == 401
+
+
+def test_login_holds_no_connection_while_hashing(client, conn, make_users, monkeypatch):
+    import api.authentication as auth
+    username = conn.get(User, make_users(1)[0]).username
+    conn.commit()
+
+    checked_out = []
+    verify = auth.verify_and_update_password
+    async def counted_verify(*args):
+        checked_out.append(get_engine().pool.checkedout())
+        return await verify(*args)
+    monkeypatch.setattr(auth, "verify_and_update_password", counted_verify)
+
+    assert client.post("/token", data={"username": username, "password": PASSWORD}).status_code == 200
+    assert checked_out == [0]
+
+
+def test_password_workers_wait_on_the_event_loop():
+    from api.authentication import PasswordWorkers
+    workers = PasswordWorkers(workers=1, queue_depth=1)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(workers.run(release.wait))
+        second = asyncio.ensure_future(workers.run(lambda: "done"))
+        await asyncio.sleep(0.05)
+        # Both admitted calls are pending without blocking the loop, a third is turned away
+        assert not first.done() and not second.done()
+        with pytest.raises(HTTPException) as e:
+            await workers.run(lambda: None)
+        assert e.value.status_code == 503
+
+        release.set()
+        assert await asyncio.wait_for(asyncio.gather(first, second), 5) == [True, "done"]
+
+    asyncio.run(main())
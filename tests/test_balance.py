@@ -0,0 +1,35 @@
+from sqlalchemy import event
+from database import Transaction
+from database.models.types import SessionData
+from tests.test_transactions import post
+
+
+def upserted_user_ids(engine, write) -> dict[str, list[int]]:
+    """Runs write, returning the user ids of each balance upsert in the order they were sent"""
+    upserts: dict[str, list[int]] = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        for table in ("userbalance", "usergroupbalance"):
+            if statement.startswith(f"INSERT INTO {table} "):
+                keys = sorted((x for x in parameters if x.startswith("user_id_m")), key=lambda x: int(x[len("user_id_m"):]))
+                upserts.setdefault(table, []).extend(parameters[x] for x in keys)
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        write()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return upserts
+
+
+def test_balances_are_locked_in_user_order(engine, conn, make_group):
+    group_id, members = make_group(4)
+    payer = max(members)
+    session = SessionData(conn=conn, user_id=payer)
+
+    upserts = upserted_user_ids(engine, lambda: Transaction.create_transaction(post(group_id, [(payer, x, "1.00") for x in reversed(members) if x != payer]), session))
+    assert upserts["userbalance"] == sorted(members)
+    assert upserts["usergroupbalance"] == sorted(members)
+
+    session_id = Transaction.create_transaction(post(group_id, [(payer, min(members), "1.00")], is_session=True), session)
+    upserts = upserted_user_ids(engine, lambda: Transaction.close_sessions(group_id, [session_id], session))
+    assert upserts["usergroupbalance"] == sorted([payer, min(members)])
@@ -0,0 +1,38 @@
+from settings import get_settings
+from tests.conftest import auth_headers
+
+HEADER = "ref,description,amount,transaction_date,category,sub_category,notes,is_session,is_session_closed,is_itemized,group_id,payer,payee,breakdown_amount\n"
+
+
+def csv_headers(user_id: int) -> dict[str, str]:
+    return {**auth_headers(user_id), "Content-Type": "text/csv"}
+
+
+def test_csv_import(client, make_group):
+    group_id, (a, b) = make_group(2)
+    body = HEADER + "".join(f"{ref},Café {ref},3.00,2024-01-0{ref},General,Others,,false,false,false,{group_id},{a},{b},3.00\n" for ref in (1, 2))
+
+    response = client.post("/transaction/bulk", content=body.encode(), headers=csv_headers(a))
+    assert response.status_code == 200, response.text
+    assert response.json()["inserted"] == 2
+
+
+def test_csv_must_be_utf8(client, make_group):
+    group_id, (a, b) = make_group(2)
+    body = HEADER + f"1,Café,3.00,2024-01-01,General,Others,,false,false,false,{group_id},{a},{b},3.00\n"
+
+    response = client.post("/transaction/bulk", content=body.encode("latin-1"), headers=csv_headers(a))
+    assert response.status_code == 400
+    assert "UTF-8" in response.json()["detail"]
+
+
+def test_oversized_import_is_rejected(client, make_group, monkeypatch):
+    group_id, (a, _) = make_group(2)
+    monkeypatch.setattr(get_settings(), "max_import_bytes", 100)
+
+    assert client.post("/transaction/bulk", content=b"{}\n" * 50, headers=auth_headers(a)).status_code == 413
+
+    def chunked():
+        for _ in range(50):
+            yield b"{}\n"
+    assert client.post("/transaction/bulk", content=chunked(), headers=auth_headers(a)).status_code == 413
@@ -0,0 +1,69 @@
+import time
+import pytest
+import cache
+import events
+from cache import Cache, RedisBackend, overview_key, settlement_key
+from database import Transaction
+from database.models.types import SessionData
+from tests.conftest import auth_headers
+from tests.test_transactions import post
+
+
+class RedisStandIn:
+    """The part of the redis-py client RedisBackend uses, kept in a dict"""
+    def __init__(self):
+        self.values: dict[str, tuple[float, str]] = {}
+
+    def get(self, key: str) -> str | None:
+        entry = self.values.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: str, px: int):
+        self.values[key] = (time.monotonic() + px / 1000, value)
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+@pytest.fixture()
+def redis_cache(monkeypatch) -> Cache:
+    shared = Cache(RedisBackend(RedisStandIn()), default_ttl=30)
+    monkeypatch.setattr(cache, "get_cache", lambda: shared)
+    return shared
+
+
+def test_redis_backend_round_trip(redis_cache):
+    assert redis_cache.get_or_set("overview:1", lambda: {"balance": "1.50", "sessions": 2}) == {"balance": "1.50", "sessions": 2}
+    assert redis_cache.get_or_set("overview:1", lambda: pytest.fail("computed twice")) == {"balance": "1.50", "sessions": 2}
+    assert redis_cache.stats() == {"overview": {"hits": 1, "misses": 1}}
+
+
+def test_events_invalidate_redis_entries(redis_cache):
+    for key in (overview_key(1), overview_key(2), settlement_key(10, False), settlement_key(10, True), settlement_key(11, False)):
+        redis_cache.get_or_set(key, lambda: "value")
+
+    events.emit(events.TRANSACTIONS_CHANGED, group_ids=[10], user_ids=[1], balance_deltas={}, sessions_changed=False)
+    assert redis_cache.backend.get(overview_key(1)) is None
+    assert redis_cache.backend.get(settlement_key(10, False)) is None
+    assert redis_cache.backend.get(settlement_key(10, True)) is None
+    assert redis_cache.backend.get(overview_key(2)) == '"value"'
+    assert redis_cache.backend.get(settlement_key(11, False)) == '"value"'
+
+    events.emit(events.MEMBERSHIP_CHANGED, group_ids=[11], user_ids=[2])
+    assert redis_cache.backend.get(overview_key(2)) is None
+    assert redis_cache.backend.get(settlement_key(11, False)) == '"value"'
+
+
+def test_overview_refreshes_without_the_change_event(client, conn, make_group, monkeypatch):
+    group_id, (a, b) = make_group(2)
+    assert client.get("/user/overview", headers=auth_headers(a)).json() == {"balance": 0, "sessions": 0}
+
+    # As if another worker wrote: its change event never reaches this worker's cache
+    monkeypatch.setattr(events, "_listeners", {})
+    Transaction.create_transaction(post(group_id, [(a, b, "10.00")]), SessionData(conn=conn, user_id=a))
+    Transaction.create_transaction(post(group_id, [(a, b, "2.00")], is_session=True), SessionData(conn=conn, user_id=a))
+
+    assert client.get("/user/overview", headers=auth_headers(a)).json() == {"balance": 12.0, "sessions": 1}
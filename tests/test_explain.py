@@ -0,0 +1,85 @@
+"""
+Checks that the group lookups are served by an index.
+
+Each classmethod runs while its SQL is captured, then every captured statement is EXPLAINed with sequential scans
+disabled. Postgres only falls back to a Seq Scan in that mode when no index can answer the query. Every lookup filters
+by group, so the index must also lead with group_id: one leading with another column would be read end to end.
+"""
+import json
+from typing import Callable
+import pytest
+from sqlalchemy import event, text
+from database import Transaction
+from database.models.types import SessionData
+from tests.test_transactions import post
+
+# name -> (call, the table it reads by group_id)
+CASES: dict[str, tuple[Callable[[int, SessionData], object], str]] = {
+    "get_group_transactions": (lambda group_id, s: Transaction.get_group_transactions(group_id, s), "transaction"),
+    "get_group_sessions": (lambda group_id, s: Transaction.get_group_sessions(group_id, s), "transaction"),
+    "get_active_session": (lambda group_id, s: Transaction.get_active_session(s), "transaction"),
+    "get_group_balance": (lambda group_id, s: Transaction.get_group_balance(group_id, s), "usergroupbalance"),
+}
+
+
+def index_names(plan: dict) -> list[str]:
+    found = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        found += index_names(child)
+    return found
+
+
+def scans(plan: dict) -> list[tuple[str, str | None]]:
+    """(relation, index name) of every scan in the plan, the index is None for a Seq Scan"""
+    found: list[tuple[str, str | None]] = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append((plan["Relation Name"], None))
+    elif plan.get("Node Type") == "Bitmap Heap Scan":
+        # The indexes are named by the Bitmap Index Scans below it
+        found += [(plan["Relation Name"], x) for x in index_names(plan)]
+    elif "Relation Name" in plan:
+        found.append((plan["Relation Name"], plan.get("Index Name")))
+    for child in plan.get("Plans", []):
+        found += scans(child)
+    return found
+
+
+def leading_column(conn, index: str) -> str:
+    return conn.execute(text(
+        "SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] "
+        "WHERE i.indexrelid = CAST(:index AS regclass)"
+    ), {"index": index}).scalar_one()
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_lookup_uses_an_index(name, engine, conn, make_group):
+    group_id, members = make_group(3)
+    session = SessionData(conn=conn, user_id=members[0])
+    Transaction.create_transaction(post(group_id, [(members[0], members[1], "5.00")]), session)
+    Transaction.create_transaction(post(group_id, [(members[1], members[2], "2.00")], is_session=True), session)
+
+    statements: list[tuple[str, dict]] = []
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    call, table = CASES[name]
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        call(group_id, session)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert len(statements) == 1
+
+    statement, parameters = statements[0]
+    connection = conn.connection()
+    connection.execute(text("SET LOCAL enable_seqscan = off"))
+    cursor = connection.connection.cursor()
+    cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scanned = [index for relation, index in scans(plan[0]["Plan"]) if relation == table]
+    assert scanned and None not in scanned, f"Seq Scan on {table}\n{statement}"
+    for index in scanned:
+        assert leading_column(conn, index) == "group_id", f"{index} does not lead with group_id\n{statement}"
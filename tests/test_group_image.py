@@ -0,0 +1,45 @@
+import pytest
+import storage
+from settings import get_settings
+from tests.conftest import auth_headers
+
+# Not decodable, so the thumbnail keeps these bytes and their signature
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+@pytest.fixture(autouse=True)
+def blob_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_settings(), "blob_store_root", str(tmp_path))
+    storage.get_blob_store.cache_clear()
+    yield
+    storage.get_blob_store.cache_clear()
+
+
+@pytest.mark.parametrize("variant", ["original", "thumbnail"])
+def test_image_is_served_with_its_content_type(client, make_group, variant):
+    group_id, (user_id,) = make_group(1)
+    response = client.put(f"/group/{group_id}/image", files={"image": ("image.png", PNG)}, headers=auth_headers(user_id))
+    assert response.status_code == 204
+
+    response = client.get(f"/group/{group_id}/image?variant={variant}", headers=auth_headers(user_id))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.content == PNG
+
+
+def test_oversized_upload_is_rejected(client, make_group, monkeypatch):
+    group_id, (user_id,) = make_group(1)
+    monkeypatch.setattr(get_settings(), "max_image_bytes", len(PNG) - 1)
+
+    response = client.put(f"/group/{group_id}/image", files={"image": ("image.png", PNG)}, headers=auth_headers(user_id))
+    assert response.status_code == 413
+    assert client.get(f"/group/{group_id}/image", headers=auth_headers(user_id)).status_code == 404
+
+
+def test_content_type_from_leading_bytes(tmp_path):
+    for data, expected in ((PNG, "image/png"), (b"\xff\xd8\xff\xe0", "image/jpeg"), (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"), (b"text", "application/octet-stream")):
+        path = tmp_path / "blob"
+        path.write_bytes(data)
+        with open(path, "rb") as file:
+            assert storage.content_type(file) == expected
+            assert file.read() == data
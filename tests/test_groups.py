@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import insert, delete
+from sqlmodel import Session, select
+from database import Group, User
+from database.models.link_model import UserGroupLink
+from tests.conftest import auth_headers
+
+
+def delete_after(monkeypatch, engine, cls, statement):
+    """Runs the statement on another connection right after the first cls.check_ids passes, like a concurrent delete"""
+    check_ids = cls.check_ids.__func__
+    calls = []
+
+    def check_then_delete(klass, ids, conn):
+        check_ids(klass, ids, conn)
+        if not calls:
+            calls.append(ids)
+            with Session(engine) as other:
+                other.execute(statement)
+                other.commit()
+    monkeypatch.setattr(cls, "check_ids", classmethod(check_then_delete))
+
+
+def test_add_member_deleted_after_validation(client, engine, make_group, make_users, monkeypatch):
+    group_id, (user_id,) = make_group(1)
+    (deleted_id,) = make_users(1)
+    delete_after(monkeypatch, engine, User, delete(User).where(User.id == deleted_id))
+
+    response = client.post(f"/group/{group_id}/members", json={"user_ids": [deleted_id]}, headers=auth_headers(user_id))
+    assert response.status_code == 400
+    assert str(deleted_id) in response.json()["detail"]
+
+
+def test_join_group_deleted_after_validation(client, engine, conn, make_users, monkeypatch):
+    (user_id,) = make_users(1)
+    group_id = conn.execute(insert(Group.__table__).values(name="Empty", type="General", deleted=False, version=0).returning(Group.__table__.c.id)).scalar_one()  # type: ignore
+    conn.commit()
+    delete_after(monkeypatch, engine, Group, delete(Group).where(Group.id == group_id))
+
+    response = client.post("/user/groups", json={"group_ids": [group_id]}, headers=auth_headers(user_id))
+    assert response.status_code == 404
+    assert conn.exec(UserGroupLink.__table__.select().where(UserGroupLink.user_id == user_id)).all() == []  # type: ignore
+
+
+def test_balance_history_rejects_until_before_since(client, make_group):
+    group_id, (user_id,) = make_group(1)
+    url = f"/group/{group_id}/balance_history"
+
+    assert client.get(url, params={"since": "2024-03-10", "until": "2024-03-09"}, headers=auth_headers(user_id)).status_code == 400
+    assert client.get(url, params={"since": "2024-03-10", "until": "2024-03-10"}, headers=auth_headers(user_id)).status_code == 200
+
+
+def test_group_helpers_take_a_plain_session(conn):
+    from api.groups import create_group, update_group, delete_group
+    from database.errors import GroupDoesNotExistError
+    create_group(conn, "Before", "Trip")
+    group_id = conn.exec(select(Group.id).order_by(Group.id.desc())).first()  # type: ignore
+
+    update_group(conn, group_id, name="After")
+    assert conn.get(Group, group_id).name == "After"
+
+    delete_group(conn, group_id)
+    with pytest.raises(GroupDoesNotExistError):
+        update_group(conn, group_id, name="Gone")
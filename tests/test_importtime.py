@@ -0,0 +1,13 @@
+from benchmarks.importtime import measure
+
+# Far above the usual import time, only there to catch a heavy import slipping into main
+BUDGET_MS = 5000
+
+
+def test_importing_main_is_lazy_and_within_budget():
+    runs = [measure() for _ in range(2)]
+    cumulative, (lazy_engine, lazy_crypto) = min(runs, key=lambda x: x[0].get("main", 0))
+
+    assert lazy_engine, "importing main created the database engine"
+    assert lazy_crypto, "importing main built the password context"
+    assert cumulative["main"] / 1000 < BUDGET_MS
@@ -0,0 +1,22 @@
+from datetime import date
+from database import Transaction
+from database.models.types import SessionData
+from instrumentation import registry
+from tests.conftest import auth_headers
+from tests.test_transactions import post
+
+ROUTE = ("GET", "/transaction/group_transactions/stream")
+
+
+def test_streamed_response_counts_statements_run_while_streaming(client, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    for day in range(1, 4):
+        Transaction.create_transaction(post(group_id, [(a, b, "1.00")], transaction_date=date(2024, 1, day)), SessionData(conn=conn, user_id=a))
+    before = registry.statements[ROUTE]
+
+    response = client.get(f"/transaction/group_transactions/stream?group_id={group_id}", headers=auth_headers(a))
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 3
+
+    # The principal lookup before the response starts, and the listing that runs while the body streams
+    assert registry.statements[ROUTE] - before == 2
@@ -0,0 +1,22 @@
+import pytest
+from settings import get_settings
+
+PATHS = ["/internal/pool", "/internal/cache", "/metrics", "/internal/subscriptions"]
+
+
+@pytest.fixture()
+def internal_token(monkeypatch) -> str:
+    monkeypatch.setattr(get_settings(), "internal_token", "secret")
+    return "secret"
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_disabled_without_token(client, path):
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_requires_token(client, internal_token, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert client.get(path, headers={"Authorization": f"Bearer {internal_token}"}).status_code == 200
@@ -0,0 +1,26 @@
+import random
+from datetime import date
+import pytest
+from database import Transaction
+from database.models.link_model import Journal
+from database.models.types import SessionData
+from tests.test_transactions import post
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_users_balance_matches_reference(conn, make_group, seed):
+    rng = random.Random(seed)
+    group_id, members = make_group(rng.randint(2, 8))
+    session = SessionData(conn=conn, user_id=members[0])
+    transaction_ids = []
+    for _ in range(rng.randint(1, 30)):
+        payer = rng.choice(members)
+        breakdowns = [(payer, payee, f"{rng.randint(1, 50_000) / 100:.2f}") for payee in rng.sample(members, rng.randint(1, len(members)))]
+        transaction_ids.append(Transaction.create_transaction(post(group_id, breakdowns, transaction_date=date(2024, 1, rng.randint(1, 31))), session))
+
+    # A random subset, including ids that do not exist
+    picked = rng.sample(transaction_ids, rng.randint(1, len(transaction_ids))) + [-1]
+    expected = {x.user_id: x.amount for x in Journal.get_users_balance_reference(picked, session)}
+    actual = {x.user_id: x.amount for x in Journal.get_users_balance(picked, session)}
+    assert actual == expected
+    assert sum(actual.values()) == 0
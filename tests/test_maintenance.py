@@ -0,0 +1,53 @@
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import text
+from sqlmodel import Session
+from database import Transaction, Group
+from database.maintenance import snapshot_balances, check_balances
+from database.models.link_model import BalanceSnapshot
+from database.models.types import SessionData
+from tests.test_transactions import post
+
+
+def test_snapshot_waits_for_backdated_write(engine, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    yesterday = date.today() - timedelta(days=1)
+    Transaction.create_transaction(post(group_id, [(a, b, "10.00")], transaction_date=yesterday - timedelta(days=1)), SessionData(conn=conn, user_id=a))
+
+    with Session(engine) as writer:
+        # A backdated write in flight, holding the group row like create_transaction does
+        Group.bump_version([group_id], writer)
+        snapshot = threading.Thread(target=lambda: snapshot_balances(Session(engine), yesterday))
+        snapshot.start()
+        time.sleep(0.2)
+        Transaction.create_transaction(post(group_id, [(b, a, "4.00")], transaction_date=yesterday), SessionData(conn=writer, user_id=b))
+        snapshot.join(timeout=10)
+
+    assert not snapshot.is_alive()
+    saved = BalanceSnapshot.latest(group_id, yesterday, conn)
+    assert saved is not None and saved.amounts() == {a: Decimal("6.00"), b: Decimal("-6.00")}
+
+
+def test_check_balances_after_writes(conn, make_group):
+    group_id, (a, b, c) = make_group(3)
+    session = SessionData(conn=conn, user_id=a)
+    Transaction.create_transaction(post(group_id, [(a, b, "7.25"), (a, c, "2.75")]), session)
+    Transaction.create_transaction(post(group_id, [(c, a, "1.00")], is_session=True), session)
+
+    assert check_balances(conn) == []
+
+
+def test_create_indexes_builds_missing_and_drops_superseded(engine):
+    from database.maintenance import create_indexes
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as setup:
+        setup.execute(text("DROP INDEX ix_transaction_group_id_open_session"))
+        setup.execute(text('CREATE INDEX ix_transaction_group_id ON "transaction" (group_id)'))
+
+    statements = create_indexes(engine)
+    assert statements == [
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_transaction_group_id_open_session ON transaction (group_id) WHERE is_session AND NOT is_session_closed',
+        'DROP INDEX CONCURRENTLY IF EXISTS "ix_transaction_group_id"',
+    ]
+    assert create_indexes(engine) == []
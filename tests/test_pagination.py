@@ -0,0 +1,66 @@
+import json
+from datetime import date, timedelta
+from database import Transaction
+from database.models.types import SessionData
+from tests.conftest import auth_headers
+from tests.test_transactions import post
+
+TODAY = date(2024, 3, 10)
+
+
+def make_transactions(conn, make_group) -> tuple[int, int, list[int]]:
+    """A group whose transactions mostly share a date, returns (group id, member, ids newest first)"""
+    group_id, (a, b) = make_group(2)
+    dates = [TODAY] * 5 + [TODAY - timedelta(days=1)] * 2 + [TODAY - timedelta(days=30)]
+    ids = Transaction.bulk_create([post(group_id, [(a, b, "1.00")], transaction_date=x) for x in dates], SessionData(conn=conn, user_id=a))
+    newest_first = sorted(zip(dates, ids), reverse=True)
+    return group_id, a, [x for _, x in newest_first]
+
+
+def test_cursor_walks_pages_sharing_a_date(client, conn, make_group):
+    group_id, user_id, ids = make_transactions(conn, make_group)
+
+    seen: list[int] = []
+    params: dict = {"group_id": group_id, "limit": 2}
+    for _ in range(len(ids)):
+        response = client.get("/transaction/group_transactions", params=params, headers=auth_headers(user_id))
+        assert response.status_code == 200
+        seen += [x["id"] for x in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    assert seen == ids
+
+
+def test_since_and_until_bound_the_dates(client, conn, make_group):
+    group_id, user_id, ids = make_transactions(conn, make_group)
+
+    params = {"group_id": group_id, "since": str(TODAY - timedelta(days=1)), "until": str(TODAY - timedelta(days=1))}
+    response = client.get("/transaction/group_transactions", params=params, headers=auth_headers(user_id))
+    assert [x["id"] for x in response.json()] == ids[5:7]
+
+    params = {"group_id": group_id, "since": str(TODAY - timedelta(days=1))}
+    response = client.get("/transaction/group_transactions", params=params, headers=auth_headers(user_id))
+    assert [x["id"] for x in response.json()] == ids[:7]
+
+
+def test_bad_cursor_is_rejected(client, make_users):
+    user_id = make_users(1)[0]
+    for cursor in ("not-base64!", "bm90IGEgY3Vyc29y"):
+        response = client.get("/transaction/group_transactions", params={"group_id": 1, "cursor": cursor}, headers=auth_headers(user_id))
+        assert response.status_code == 400
+
+
+def test_stream_returns_every_transaction_as_ndjson(client, conn, make_group):
+    group_id, user_id, ids = make_transactions(conn, make_group)
+
+    response = client.get("/transaction/group_transactions/stream", params={"group_id": group_id}, headers=auth_headers(user_id))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(x) for x in response.text.splitlines()]
+    assert [x["id"] for x in rows] == ids
+    assert rows[0]["transaction_date"] == str(TODAY)
+
+    response = client.get("/transaction/group_transactions/stream", params={"group_id": group_id, "until": str(TODAY - timedelta(days=2))}, headers=auth_headers(user_id))
+    assert [json.loads(x)["id"] for x in response.text.splitlines()] == ids[7:]
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+import pytest
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+import database
+from cache import get_cache, overview_key, recent_write_key
+from database.routing import RoutingSession, cache_ttl, read_session
+from settings import get_settings
+from tests.conftest import auth_headers
+from tests.test_transactions import post
+
+
+@pytest.fixture()
+def replica(engine, monkeypatch) -> Engine:
+    """A replica engine on the test database itself, as database_replica_url allows for testing"""
+    url = os.environ["TEST_DATABASE_URL"]
+    monkeypatch.setattr(get_settings(), "database_replica_url", url)
+    replica = database._create_engine(url, get_settings())
+    monkeypatch.setattr(database, "_replica_engine", replica)
+    yield replica
+    replica.dispose()
+
+
+@pytest.fixture()
+def recorded_ttls(monkeypatch) -> dict[str, float]:
+    """key -> ttl of every cache entry stored while the test runs"""
+    ttls: dict[str, float] = {}
+    backend = get_cache().backend
+    store = backend.set
+    def record(key: str, value: str, ttl: float):
+        ttls[key] = ttl
+        store(key, value, ttl)
+    monkeypatch.setattr(backend, "set", record)
+    return ttls
+
+
+def test_without_a_replica_reads_use_the_primary(engine, make_users):
+    user_id = make_users(1)[0]
+    with read_session(user_id) as conn:
+        assert not isinstance(conn, RoutingSession)
+        assert cache_ttl(conn) is None
+
+
+def test_read_session_queries_the_replica(replica, make_users):
+    user_id = make_users(1)[0]
+    with read_session(user_id) as conn:
+        assert isinstance(conn, RoutingSession)
+        assert conn.get_bind() is replica
+        assert cache_ttl(conn) == get_settings().replica_sticky_seconds
+
+
+def test_reads_stick_to_the_primary_after_a_write(client, replica, make_group, monkeypatch):
+    monkeypatch.setattr(get_settings(), "replica_sticky_seconds", 0.5)
+    group_id, (a, b) = make_group(2)
+
+    response = client.post("/transaction", json=json.loads(post(group_id, [(a, b, "2.00")]).json()), headers=auth_headers(a))
+    assert response.status_code == 200
+    with read_session(a) as conn:
+        assert not isinstance(conn, RoutingSession)
+    with read_session(b) as conn:
+        assert isinstance(conn, RoutingSession)
+
+    time.sleep(0.6)
+    with read_session(a) as conn:
+        assert isinstance(conn, RoutingSession)
+
+
+def test_overview_read_from_the_replica_is_cached_for_the_sticky_window(client, replica, make_users, recorded_ttls):
+    user_id = make_users(1)[0]
+    get_cache().invalidate([overview_key(user_id), recent_write_key(user_id)])
+
+    assert client.get("/user/overview", headers=auth_headers(user_id)).status_code == 200
+    assert recorded_ttls[overview_key(user_id)] == get_settings().replica_sticky_seconds
+
+    # Once the user writes, reads go to the primary and are cached for the usual ttl
+    with Session(database.get_engine()) as conn:
+        conn.info["user_id"] = user_id
+        conn.connection()
+        conn.commit()
+    get_cache().invalidate([overview_key(user_id)])
+    assert client.get("/user/overview", headers=auth_headers(user_id)).status_code == 200
+    assert recorded_ttls[overview_key(user_id)] == get_settings().cache_ttl
@@ -0,0 +1,109 @@
+import threading
+import time
+from decimal import Decimal
+from sqlmodel import Session, select
+from database import Transaction, Group
+from database.maintenance import check_balances
+from database.models.link_model import UserGroupBalance
+from database.models.types import SessionData
+from tests.conftest import auth_headers
+from tests.test_transactions import post
+
+
+def start(fn) -> tuple[threading.Thread, list]:
+    """Runs fn on another thread, returning the thread and a list its result or exception is appended to"""
+    outcome: list = []
+
+    def run():
+        try:
+            outcome.append(fn())
+        except Exception as e:
+            outcome.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_close_waits_for_a_write_holding_the_group(engine, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    Transaction.create_transaction(post(group_id, [(a, b, "5.00")], is_session=True), SessionData(conn=conn, user_id=a))
+
+    with Session(engine) as writer:
+        # A create_transaction in flight, it has bumped the group and is about to update the balances
+        Group.bump_version([group_id], writer)
+        close, closed = start(lambda: Transaction.close_sessions(group_id, None, SessionData(conn=Session(engine), user_id=a)))
+        time.sleep(0.2)
+        Transaction.create_transaction(post(group_id, [(b, a, "1.00")]), SessionData(conn=writer, user_id=b))
+        close.join(timeout=10)
+
+    assert not close.is_alive()
+    assert len(closed) == 1 and len(closed[0]) == 1
+
+
+def test_bulk_import_waits_for_a_write_holding_the_group(engine, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    other_id, (c, d) = make_group(2)
+    rows = [post(other_id, [(c, d, "2.00")]), post(group_id, [(a, b, "3.00")])]
+
+    with Session(engine) as writer:
+        Group.bump_version([group_id], writer)
+        bulk, imported = start(lambda: Transaction.bulk_create(rows, SessionData(conn=Session(engine), user_id=a)))
+        time.sleep(0.2)
+        Transaction.create_transaction(post(group_id, [(b, a, "1.00")]), SessionData(conn=writer, user_id=b))
+        bulk.join(timeout=10)
+
+    assert not bulk.is_alive()
+    assert len(imported) == 1 and len(imported[0]) == 2
+    assert check_balances(conn) == []
+
+
+def settled_balances(group_id: int, conn) -> dict[int, Decimal]:
+    rows = conn.exec(select(UserGroupBalance.user_id, UserGroupBalance.settled).where(UserGroupBalance.group_id == group_id)).all()
+    return {user_id: settled for user_id, settled in rows if settled != 0}
+
+
+def test_close_endpoint_settles_sessions_once(client, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    session = SessionData(conn=conn, user_id=a)
+    Transaction.create_transaction(post(group_id, [(a, b, "5.00")]), session)
+    ids = [Transaction.create_transaction(post(group_id, [(a, b, x)], is_session=True), session) for x in ("3.00", "2.00")]
+    assert settled_balances(group_id, conn) == {a: Decimal("5.00"), b: Decimal("-5.00")}
+
+    response = client.post(f"/group/{group_id}/sessions/close", json={}, headers=auth_headers(a))
+    assert response.status_code == 200
+    assert response.json() == {"closed": sorted(ids), "settlement": [{"debtor_id": a, "debtee_id": b, "amount": 10.0}]}
+    conn.expire_all()
+    assert settled_balances(group_id, conn) == {a: Decimal("10.00"), b: Decimal("-10.00")}
+
+    again = client.post(f"/group/{group_id}/sessions/close", json={"transaction_ids": ids}, headers=auth_headers(a))
+    assert again.json()["closed"] == []
+    conn.expire_all()
+    assert settled_balances(group_id, conn) == {a: Decimal("10.00"), b: Decimal("-10.00")}
+    assert check_balances(conn) == []
+
+
+def test_concurrent_closes_settle_each_session_once(engine, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    session = SessionData(conn=conn, user_id=a)
+    ids = [Transaction.create_transaction(post(group_id, [(a, b, "1.00")], is_session=True), session) for _ in range(5)]
+
+    closes = [start(lambda: Transaction.close_sessions(group_id, None, SessionData(conn=Session(engine), user_id=a))) for _ in range(4)]
+    for thread, _ in closes:
+        thread.join(timeout=10)
+
+    closed = [outcome[0] for _, outcome in closes]
+    assert sorted(x for ids_closed in closed for x in ids_closed) == sorted(ids)
+    assert settled_balances(group_id, conn) == {a: Decimal("5.00"), b: Decimal("-5.00")}
+    assert check_balances(conn) == []
+
+
+def test_close_ignores_sessions_of_other_groups(conn, make_group):
+    group_id, (a, b) = make_group(2)
+    other_id, (c, d) = make_group(2)
+    own = Transaction.create_transaction(post(group_id, [(a, b, "1.00")], is_session=True), SessionData(conn=conn, user_id=a))
+    foreign = Transaction.create_transaction(post(other_id, [(c, d, "4.00")], is_session=True), SessionData(conn=conn, user_id=c))
+
+    assert Transaction.close_sessions(group_id, [own, foreign], SessionData(conn=conn, user_id=a)) == [own]
+    assert [x.id for x in Transaction.get_group_sessions(other_id, SessionData(conn=conn, user_id=c))] == [foreign]
+    assert settled_balances(other_id, conn) == {}
+    assert check_balances(conn) == []
@@ -0,0 +1,54 @@
+import random
+from decimal import Decimal
+import pytest
+from database.models.link_model.journal import Balance, simplify, OPTIMAL_MAX_MEMBERS
+from benchmarks.simplify import random_balance
+
+
+def settle(balance: list[Balance], plan) -> dict[int, Decimal]:
+    """Balances left after every transfer in the plan is paid"""
+    left = {x.user_id: x.amount for x in balance}
+    for transfer in plan:
+        left[transfer.debtor_id] -= transfer.amount
+        left[transfer.debtee_id] += transfer.amount
+    return left
+
+
+def with_zero_sum_pairs(members: int, rng: random.Random) -> list[Balance]:
+    """Balances made of pairs that cancel out, where the optimal plan needs half the members in transfers"""
+    balance = []
+    for user_id in range(0, members - members % 2, 2):
+        cents = rng.randint(1, 50_000)
+        balance += [Balance(user_id=user_id, amount=Decimal(cents).scaleb(-2)), Balance(user_id=user_id + 1, amount=Decimal(-cents).scaleb(-2))]
+    return balance
+
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("optimal", [False, True])
+def test_plan_settles_every_balance(seed, optimal):
+    rng = random.Random(seed)
+    balance = random_balance(rng.randint(1, 40), rng)
+    plan = simplify(balance, optimal)
+
+    assert all(x.amount > 0 for x in plan)
+    assert all(amount == 0 for amount in settle(balance, plan).values())
+    assert len(plan) <= max(len([x for x in balance if x.amount != 0]) - 1, 0)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_optimal_never_needs_more_transfers(seed):
+    rng = random.Random(seed)
+    members = rng.randint(1, OPTIMAL_MAX_MEMBERS)
+    balance = random_balance(members, rng) if seed % 2 else with_zero_sum_pairs(members, rng)
+    rng.shuffle(balance)
+
+    optimal = simplify(balance, True)
+    assert all(amount == 0 for amount in settle(balance, optimal).values())
+    assert len(optimal) <= len(simplify(balance))
+    if seed % 2 == 0:
+        assert len(optimal) == len(balance) // 2
+
+
+def test_mismatched_balance():
+    with pytest.raises(ValueError):
+        simplify([Balance(user_id=1, amount=Decimal("1.00")), Balance(user_id=2, amount=Decimal("-0.99"))])
@@ -0,0 +1,80 @@
+"""
+Fails when an endpoint runs more SQL statements than its budget, e.g. after an N+1 query slips in.
+
+Requests run cold: the principal and derived-view caches are emptied first, so every query the handler can run is counted.
+The group has several members and transactions, so per-row queries would show up as a count above the budget.
+"""
+import json
+from datetime import date, timedelta
+from typing import Any, Callable
+import pytest
+from sqlalchemy import event
+import api.authentication as auth
+from cache import get_cache, overview_key, settlement_key
+from database import Transaction, get_engine
+from database.models.types import SessionData
+from tests.conftest import auth_headers
+from tests.test_transactions import post
+
+# (method, path) -> most statements allowed, {group_id} is filled in
+BUDGETS = {
+    ("GET", "/user/overview"): 4,
+    ("GET", "/user/active_sessions"): 2,
+    ("GET", "/transaction/group_transactions?group_id={group_id}"): 2,
+    ("GET", "/transaction/group_sessions?group_id={group_id}"): 2,
+    ("GET", "/transaction/simplify_debt?group_id={group_id}"): 3,
+    ("GET", "/group/{group_id}/settlement"): 3,
+    ("GET", "/group/{group_id}/users"): 2,
+    ("GET", "/group/{group_id}/balance_history?since=2000-01-01"): 4,
+    ("POST", "/transaction"): 8,
+    ("POST", "/group/{group_id}/members"): 5,
+    ("POST", "/group/{group_id}/sessions/close"): 9,
+}
+
+# (method, path) -> request body, given the group id and its members
+BODIES: dict[tuple[str, str], Callable[[int, list[int]], Any]] = {
+    ("POST", "/transaction"): lambda group_id, members: json.loads(post(group_id, [(members[0], x, "3.00") for x in members[1:]]).json()),
+    ("POST", "/group/{group_id}/members"): lambda group_id, members: {"user_ids": members},
+    ("POST", "/group/{group_id}/sessions/close"): lambda group_id, members: {},
+}
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements: list[str] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@pytest.fixture()
+def seeded_group(conn, make_group) -> tuple[int, list[int]]:
+    group_id, members = make_group(6)
+    session = SessionData(conn=conn, user_id=members[0])
+    for index, payer in enumerate(members):
+        payees = [x for x in members if x != payer][:3]
+        breakdowns = [(payer, payee, f"{index + 1}.25") for payee in payees]
+        Transaction.create_transaction(post(group_id, breakdowns, transaction_date=date.today() - timedelta(days=index)), session)
+        Transaction.create_transaction(post(group_id, breakdowns, is_session=True), session)
+    return group_id, members
+
+
+@pytest.mark.parametrize("method,path", list(BUDGETS))
+def test_statement_budget(client, seeded_group, method, path):
+    group_id, members = seeded_group
+    user_id = members[0]
+    auth.principal_cache().invalidate(user_id)
+    get_cache().invalidate([overview_key(user_id), settlement_key(group_id, False)])
+
+    body = BODIES[(method, path)](group_id, members) if (method, path) in BODIES else None
+
+    counter = StatementCounter()
+    event.listen(get_engine(), "before_cursor_execute", counter)
+    try:
+        response = client.request(method, path.format(group_id=group_id), json=body, headers=auth_headers(user_id))
+    finally:
+        event.remove(get_engine(), "before_cursor_execute", counter)
+
+    assert response.status_code == 200, response.text
+    budget = BUDGETS[(method, path)]
+    assert len(counter.statements) <= budget, "\n\n".join(counter.statements)
@@ -0,0 +1,124 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import update
+from sqlmodel import select
+from api.model.request import TransactionPost, Breakdown
+from database import Transaction, Journal
+from database.models.idempotency import IdempotencyKey
+from database.models.link_model import UserGroupBalance
+from database.models.types import SessionData
+from tests.conftest import auth_headers
+
+
+def post(group_id: int, breakdowns: list[tuple[int, int, str]], **fields) -> TransactionPost:
+    return TransactionPost(
+        description=fields.pop("description", "Expense"),
+        amount=fields.pop("amount", sum((Decimal(x[2]) for x in breakdowns), Decimal(0))),
+        transaction_date=fields.pop("transaction_date", date.today()),
+        group_id=group_id,
+        breakdowns=[Breakdown(payer=payer, payee=payee, amount=Decimal(amount), item_detail={}) for payer, payee, amount in breakdowns],
+        **fields,
+    )
+
+
+def group_balances(group_id: int, conn) -> dict[int, Decimal]:
+    rows = conn.exec(select(UserGroupBalance.user_id, UserGroupBalance.amount).where(UserGroupBalance.group_id == group_id)).all()
+    return {user_id: amount for user_id, amount in rows if amount != 0}
+
+
+def test_create_transaction_merges_breakdowns(conn, make_group):
+    group_id, (a, b, c) = make_group(3)
+    session = SessionData(conn=conn, user_id=a)
+
+    transaction_id = Transaction.create_transaction(post(group_id, [(a, b, "10.00"), (a, b, "5.50"), (a, c, "4.50")]), session)
+
+    journals = conn.exec(select(Journal.payee_id, Journal.amount).where(Journal.transaction_id == transaction_id)).all()
+    assert sorted(journals) == [(b, Decimal("15.50")), (c, Decimal("4.50"))]
+    assert group_balances(group_id, conn) == {a: Decimal("20.00"), b: Decimal("-15.50"), c: Decimal("-4.50")}
+
+
+def test_create_transaction_without_breakdowns(conn, make_group):
+    group_id, (a, _) = make_group(2)
+    session = SessionData(conn=conn, user_id=a)
+
+    transaction_id = Transaction.create_transaction(post(group_id, []), session)
+
+    assert Transaction.get_by_id(transaction_id, session).amount == 0
+    assert conn.exec(select(Journal).where(Journal.transaction_id == transaction_id)).all() == []
+    assert group_balances(group_id, conn) == {}
+
+
+def test_bulk_create_balances_match_stored_journals(conn, make_group):
+    from database.maintenance import check_balances
+    group_id, (a, b, c) = make_group(3)
+    session = SessionData(conn=conn, user_id=a)
+
+    rows = [post(group_id, [(a, b, "1.01"), (a, c, "0.99"), (a, b, "0.25")]), post(group_id, [(b, c, "0.50")], is_session=True)]
+    Transaction.bulk_create(rows, session)
+
+    assert group_balances(group_id, conn) == {a: Decimal("2.25"), b: Decimal("-0.76"), c: Decimal("-1.49")}
+    assert check_balances(conn) == []
+
+
+def test_breakdowns_are_whole_cents():
+    with pytest.raises(ValidationError):
+        Breakdown(payer=1, payee=2, amount=Decimal("1.005"), item_detail={})
+
+
+def test_bulk_create_keeps_text_that_looks_like_copy_syntax(conn, make_group):
+    group_id, (a, b) = make_group(2)
+    texts = ["\\N", "tab\there", "line\nbreak\r\n", "back\\slash", ""]
+    rows = [post(group_id, [(a, b, "1.00")], description=text, notes=text) for text in texts]
+    rows.append(post(group_id, [(a, b, "1.00")], notes=None))
+
+    ids = Transaction.bulk_create(rows, SessionData(conn=conn, user_id=a))
+    stored = {x.id: (x.description, x.notes) for x in conn.exec(select(Transaction).where(Transaction.id.in_(ids)))}  # type: ignore
+    assert [stored[x] for x in ids] == [(text, text) for text in texts] + [("Expense", None)]
+
+
+def test_idempotency_key_replays_the_first_transaction(client, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    body = json.loads(post(group_id, [(a, b, "4.00")]).json())
+    headers = {**auth_headers(a), "Idempotency-Key": "replay"}
+
+    first = client.post("/transaction", json=body, headers=headers)
+    assert first.status_code == 200
+    assert client.post("/transaction", json=body, headers=headers).json() == first.json()
+    assert len(Transaction.get_group_transactions(group_id, SessionData(conn=conn, user_id=a))) == 1
+
+    changed = client.post("/transaction", json={**body, "description": "Changed"}, headers=headers)
+    assert changed.status_code == 422
+    # The key is scoped to the user, another member may reuse it
+    assert client.post("/transaction", json=body, headers={**auth_headers(b), "Idempotency-Key": "replay"}).json() != first.json()
+
+
+def test_concurrent_duplicates_create_one_transaction(client, conn, make_group):
+    group_id, (a, b) = make_group(2)
+    body = json.loads(post(group_id, [(a, b, "4.00")]).json())
+    headers = {**auth_headers(a), "Idempotency-Key": "concurrent"}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda _: client.post("/transaction", json=body, headers=headers), range(4)))
+
+    assert {x.status_code for x in responses} == {200}
+    assert len({x.json()["id"] for x in responses}) == 1
+    assert len(Transaction.get_group_transactions(group_id, SessionData(conn=conn, user_id=a))) == 1
+    assert group_balances(group_id, conn) == {a: Decimal("4.00"), b: Decimal("-4.00")}
+
+
+def test_sweep_deletes_expired_idempotency_keys(conn, make_group):
+    group_id, (a, b) = make_group(2)
+    session = SessionData(conn=conn, user_id=a)
+    old = Transaction.create_transaction(post(group_id, [(a, b, "1.00")]), session, "old")
+    Transaction.create_transaction(post(group_id, [(a, b, "1.00")]), session, "new")
+    conn.execute(update(IdempotencyKey).where(IdempotencyKey.key == "old").values(created_at=datetime.utcnow() - timedelta(hours=49)))  # type: ignore
+    conn.commit()
+
+    assert IdempotencyKey.sweep(timedelta(hours=48), conn) == 1
+    assert conn.exec(select(IdempotencyKey.key).where(IdempotencyKey.user_id == a)).all() == ["new"]
+    # The transaction itself stays, only the replay record goes
+    assert Transaction.get_by_id(old, session).id == old